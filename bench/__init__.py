@@ -0,0 +1,9 @@
+"""
+Load benchmarks of the API.
+
+    python -m bench seed --users 1000 --posts 10000 --reactions 50000
+    python -m bench run --duration 30 --concurrency 32 --out results.json
+    python -m bench compare baseline.json results.json --threshold 0.1
+
+See bench/README.md.
+"""
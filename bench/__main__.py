@@ -0,0 +1,194 @@
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m bench")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    def add_database_args(command):
+        command.add_argument(
+            "--database-url",
+            default=os.environ.get("DATABASE_URL"),
+            help="Database to seed and serve (default: a temporary SQLite file)",
+        )
+
+    def add_seed_args(command):
+        command.add_argument("--users", type=int, default=1000)
+        command.add_argument("--posts", type=int, default=10_000)
+        command.add_argument("--reactions", type=int, default=50_000)
+        command.add_argument(
+            "--zipf", type=float, default=1.1, help="Skew of post popularity"
+        )
+        command.add_argument(
+            "--processes",
+            type=int,
+            help="Processes generating the rows (default: the number of CPUs)",
+        )
+        command.add_argument(
+            "--password-hash",
+            help="Hash given to every user, e.g. a cheap one of the load test "
+            "password, instead of hashing it",
+        )
+
+    seed = commands.add_parser("seed", help="Fill an empty database")
+    add_database_args(seed)
+    add_seed_args(seed)
+
+    run = commands.add_parser("run", help="Seed a database and load the API")
+    add_database_args(run)
+    add_seed_args(run)
+    run.add_argument(
+        "--no-seed", action="store_true", help="Use an already seeded database"
+    )
+    run.add_argument("--duration", type=float, default=30, help="Seconds")
+    run.add_argument("--concurrency", type=int, default=32)
+    run.add_argument(
+        "--server",
+        choices=["in-process", "uvicorn"],
+        default="in-process",
+        help="Call the app directly, or through a local uvicorn",
+    )
+    run.add_argument("--workers", type=int, default=1, help="uvicorn workers")
+    run.add_argument("--port", type=int, default=8765)
+    run.add_argument("--out", help="Save the results as JSON")
+    run.add_argument("--baseline", help="Results to compare with")
+    run.add_argument("--threshold", type=float, default=0.1)
+
+    serialization = commands.add_parser(
+        "serialization",
+        help="Compare the default and the fast serialization (FAST_SERIALIZATION)",
+    )
+    add_database_args(serialization)
+    add_seed_args(serialization)
+    serialization.add_argument(
+        "--no-seed", action="store_true", help="Use an already seeded database"
+    )
+    serialization.add_argument(
+        "--requests", type=int, default=200, help="Requests per endpoint and path"
+    )
+
+    search = commands.add_parser(
+        "search", help="Compare full-text search with a LIKE query on posts"
+    )
+    add_database_args(search)
+    add_seed_args(search)
+    search.add_argument(
+        "--no-seed", action="store_true", help="Use an already seeded database"
+    )
+    search.add_argument("--searches", type=int, default=50, help="Per term")
+    search.add_argument("--limit", type=int, default=50, help="Results per page")
+
+    compare = commands.add_parser("compare", help="Compare two saved runs")
+    compare.add_argument("baseline")
+    compare.add_argument("current")
+    compare.add_argument("--threshold", type=float, default=0.1)
+
+    return parser.parse_args(argv)
+
+
+def check(baseline: dict, current: dict, threshold: float) -> int:
+    from .report import compare
+
+    regressions = compare(baseline, current, threshold)
+    for regression in regressions:
+        print(f"REGRESSION {regression}")
+    return 1 if regressions else 0
+
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+
+    if args.command == "compare":
+        from .report import load
+
+        return check(load(args.baseline), load(args.current), args.threshold)
+
+    # The app reads its settings at import time
+    if args.database_url is None:
+        directory = tempfile.mkdtemp(prefix="bench-")
+        args.database_url = f"sqlite:///{directory}/bench.db"
+    os.environ["DATABASE_URL"] = args.database_url
+
+    from .seed import seed
+
+    if args.command == "seed" or not args.no_seed:
+        print(f"Seeding {args.database_url}")
+        print(
+            seed(
+                args.users,
+                args.posts,
+                args.reactions,
+                args.zipf,
+                processes=args.processes,
+                hashed_password=args.password_hash,
+            )
+        )
+    if args.command == "seed":
+        return 0
+
+    if args.command == "serialization":
+        from . import serialization
+
+        results = asyncio.run(serialization.compare_paths(args.requests))
+        serialization.print_results(results)
+        return 0 if all(result["same_output"] for result in results.values()) else 1
+
+    if args.command == "search":
+        from . import search
+
+        search.print_results(search.compare_queries(args.searches, args.limit))
+        return 0
+
+    from src import models
+    from src.database import SessionLocal
+    from . import load, report
+
+    with SessionLocal() as db:
+        posts = dict(
+            db.query(models.Post.id, models.Post.author_id).order_by(models.Post.id)
+        )
+        users = db.query(models.User).count()
+
+    server = None
+    if args.server == "uvicorn":
+        server = load.start_uvicorn(args.port, args.workers)
+        client = load.httpx.AsyncClient(base_url=f"http://127.0.0.1:{args.port}")
+    else:
+        client = load.in_process_client()
+
+    async def run():
+        async with client:
+            return await load.run_load(
+                client, users, posts, args.duration, args.concurrency
+            )
+
+    try:
+        samples, wall_time = asyncio.run(run())
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+    settings = {
+        key: value for key, value in vars(args).items()
+        if key not in ("out", "baseline", "threshold")
+    }
+    settings["env"] = {
+        key: value for key, value in os.environ.items()
+        if key.startswith(("DB_", "SQLITE_", "REACTION_", "TOKEN_", "PASSWORD_"))
+    }
+    summary = report.summarize(samples, wall_time, settings)
+    report.print_summary(summary)
+    if args.out:
+        report.save(summary, args.out)
+    if args.baseline:
+        return check(report.load(args.baseline), summary, args.threshold)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,186 @@
+"""Drive the API with a realistic traffic mix and time every request"""
+import asyncio
+import contextvars
+import os
+import random
+import subprocess
+import sys
+import time
+
+import httpx
+from sqlalchemy import event
+
+from .seed import PASSWORD, username
+
+# Relative frequency of each kind of request
+TRAFFIC_MIX = {
+    "feed": 50,
+    "post": 15,
+    "users": 8,
+    "user": 5,
+    "login": 2,
+    "like": 10,
+    "dislike": 5,
+    "cancel": 5,
+}
+
+# Statuses that are a normal outcome of a random request
+EXPECTED_STATUSES = {200, 404}
+
+QUERIES_HEADER = "x-bench-queries"
+_request_queries = contextvars.ContextVar("request_queries", default=None)
+
+
+def count_query(*args):
+    counter = _request_queries.get()
+    if counter is not None:
+        counter[0] += 1
+
+
+class QueryCountingApp:
+    """Reports the number of SQL statements of each request in a header"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        counter = [0]
+        token = _request_queries.set(counter)
+
+        async def send_with_count(message):
+            if message["type"] == "http.response.start":
+                headers = list(message.get("headers", []))
+                headers.append((QUERIES_HEADER.encode(), str(counter[0]).encode()))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_count)
+        finally:
+            _request_queries.reset(token)
+
+
+def in_process_client() -> httpx.AsyncClient:
+    from src import database
+    from src.main import app
+
+    event.listen(database.engine, "before_cursor_execute", count_query)
+    if database.async_engine is not None:
+        event.listen(
+            database.async_engine.sync_engine, "before_cursor_execute", count_query
+        )
+    return httpx.AsyncClient(app=QueryCountingApp(app), base_url="http://bench")
+
+
+def start_uvicorn(port: int, workers: int) -> subprocess.Popen:
+    command = [
+        sys.executable, "-m", "uvicorn", "src.main:app",
+        "--port", str(port), "--workers", str(workers), "--log-level", "warning",
+    ]
+    # The app reads its number of workers from WEB_CONCURRENCY
+    env = {**os.environ, "WEB_CONCURRENCY": str(workers)}
+    server = subprocess.Popen(command, env=env)
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            httpx.get(f"http://127.0.0.1:{port}/openapi.json")
+            return server
+        except httpx.TransportError:
+            time.sleep(0.2)
+    server.terminate()
+    raise RuntimeError("uvicorn did not start")
+
+
+class Traffic:
+    """Picks the next request of the mix for the seeded database"""
+
+    def __init__(self, users: int, posts: dict[int, int], tokens: dict, rng):
+        self.users = users
+        self.post_ids = list(posts)
+        self.authors = posts
+        self.tokens = tokens
+        self.rng = rng
+        self.kinds = list(TRAFFIC_MIX)
+        self.weights = list(TRAFFIC_MIX.values())
+
+    def _popular_post(self) -> int:
+        # Newest posts get most of the traffic
+        rank = min(int(self.rng.expovariate(1 / 50)), len(self.post_ids) - 1)
+        return self.post_ids[-1 - rank]
+
+    def _reaction(self, action: str):
+        user_id = self.rng.choice(list(self.tokens))
+        post_id = self._popular_post()
+        while self.authors[post_id] == user_id:
+            post_id = self.rng.choice(self.post_ids)
+        headers = {"Authorization": f"Bearer {self.tokens[user_id]}"}
+        return "PATCH", f"/posts/{post_id}/{action}", {"headers": headers}
+
+    def next(self):
+        kind = self.rng.choices(self.kinds, self.weights)[0]
+        if kind == "feed":
+            page = min(int(self.rng.expovariate(1)), 20)
+            return kind, "GET", "/posts/", {"params": {"skip": page * 50}}
+        if kind == "post":
+            return kind, "GET", f"/posts/{self._popular_post()}/", {}
+        if kind == "users":
+            page = min(int(self.rng.expovariate(1)), 20)
+            return kind, "GET", "/users/", {"params": {"skip": page * 50}}
+        if kind == "user":
+            user_id = self.rng.randint(1, self.users)
+            return kind, "GET", f"/users/{user_id}/", {}
+        if kind == "login":
+            credentials = {
+                "username": username(self.rng.randint(1, self.users)),
+                "password": PASSWORD,
+            }
+            return kind, "POST", "/account/token/", {"json": credentials}
+        return (kind, *self._reaction(kind))
+
+
+async def login(client: httpx.AsyncClient, user_ids) -> dict[int, str]:
+    tokens = {}
+    for user_id in user_ids:
+        response = await client.post(
+            "/account/token/",
+            json={"username": username(user_id), "password": PASSWORD},
+        )
+        response.raise_for_status()
+        tokens[user_id] = response.json()["access_token"]
+    return tokens
+
+
+async def _worker(client, traffic: Traffic, deadline: float, samples: list):
+    while time.perf_counter() < deadline:
+        kind, method, url, options = traffic.next()
+        start = time.perf_counter()
+        response = await client.request(method, url, **options)
+        elapsed = time.perf_counter() - start
+        queries = response.headers.get(QUERIES_HEADER)
+        if queries is not None:
+            queries = int(queries)
+        samples.append((kind, elapsed, response.status_code, queries))
+
+
+async def run_load(
+    client: httpx.AsyncClient,
+    users: int,
+    posts: dict[int, int],
+    duration: float,
+    concurrency: int,
+    writers: int = 50,
+    random_seed: int = 0,
+):
+    """Returns (kind, seconds, status, queries) samples and the wall time"""
+    rng = random.Random(random_seed)
+    tokens = await login(client, rng.sample(range(1, users + 1), min(writers, users)))
+    traffic = Traffic(users, posts, tokens, rng)
+    samples = []
+    start = time.perf_counter()
+    deadline = start + duration
+    await asyncio.gather(
+        *(_worker(client, traffic, deadline, samples) for _ in range(concurrency))
+    )
+    return samples, time.perf_counter() - start
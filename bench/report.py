@@ -0,0 +1,114 @@
+"""Summaries of benchmark samples, and comparison of two runs"""
+import json
+import math
+import platform
+from collections import defaultdict
+from datetime import datetime, timezone
+
+from .load import EXPECTED_STATUSES
+
+
+def percentile(sorted_values: list[float], fraction: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = max(math.ceil(fraction * len(sorted_values)) - 1, 0)
+    return sorted_values[index]
+
+
+def summarize(samples, wall_time: float, settings: dict) -> dict:
+    by_kind = defaultdict(list)
+    for sample in samples:
+        by_kind[sample[0]].append(sample)
+
+    endpoints = {}
+    for kind, kind_samples in sorted(by_kind.items()):
+        latencies = sorted(elapsed for _, elapsed, _, _ in kind_samples)
+        statuses = defaultdict(int)
+        for _, _, status, _ in kind_samples:
+            statuses[str(status)] += 1
+        queries = [count for _, _, _, count in kind_samples if count is not None]
+        endpoints[kind] = {
+            "requests": len(kind_samples),
+            "errors": sum(
+                1 for _, _, status, _ in kind_samples
+                if status not in EXPECTED_STATUSES
+            ),
+            "throughput": len(kind_samples) / wall_time,
+            "p50_ms": percentile(latencies, 0.50) * 1000,
+            "p95_ms": percentile(latencies, 0.95) * 1000,
+            "p99_ms": percentile(latencies, 0.99) * 1000,
+            "queries_per_request": sum(queries) / len(queries) if queries else None,
+            "statuses": dict(statuses),
+        }
+
+    return {
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "settings": settings,
+        "wall_time": wall_time,
+        "requests": len(samples),
+        "throughput": len(samples) / wall_time,
+        "endpoints": endpoints,
+    }
+
+
+def print_summary(summary: dict):
+    print(
+        f"{summary['requests']} requests in {summary['wall_time']:.1f} s, "
+        f"{summary['throughput']:.1f} req/s"
+    )
+    print(
+        f"{'endpoint':<10}{'req/s':>10}{'p50 ms':>10}{'p95 ms':>10}"
+        f"{'p99 ms':>10}{'queries':>10}{'errors':>8}"
+    )
+    for kind, stats in summary["endpoints"].items():
+        queries = stats["queries_per_request"]
+        print(
+            f"{kind:<10}{stats['throughput']:>10.1f}{stats['p50_ms']:>10.2f}"
+            f"{stats['p95_ms']:>10.2f}{stats['p99_ms']:>10.2f}"
+            f"{'-' if queries is None else f'{queries:.2f}':>10}"
+            f"{stats['errors']:>8}"
+        )
+
+
+def save(summary: dict, path: str):
+    with open(path, "w") as file:
+        json.dump(summary, file, indent=2)
+
+
+def load(path: str) -> dict:
+    with open(path) as file:
+        return json.load(file)
+
+
+def compare(baseline: dict, current: dict, threshold: float) -> list[str]:
+    """
+    Regressions of current against baseline: p95 latency or queries per
+    request grown, or throughput dropped, by more than threshold (0.1 = 10%)
+    """
+    regressions = []
+    for kind, before in baseline["endpoints"].items():
+        after = current["endpoints"].get(kind)
+        if after is None:
+            continue
+        if after["p95_ms"] > before["p95_ms"] * (1 + threshold):
+            regressions.append(
+                f"{kind}: p95 {before['p95_ms']:.2f} -> {after['p95_ms']:.2f} ms"
+            )
+        if after["throughput"] < before["throughput"] * (1 - threshold):
+            regressions.append(
+                f"{kind}: throughput {before['throughput']:.1f} -> "
+                f"{after['throughput']:.1f} req/s"
+            )
+        queries_before = before["queries_per_request"]
+        queries_after = after["queries_per_request"]
+        if (
+            queries_before is not None
+            and queries_after is not None
+            and queries_after > queries_before * (1 + threshold)
+        ):
+            regressions.append(
+                f"{kind}: queries per request {queries_before:.2f} -> "
+                f"{queries_after:.2f}"
+            )
+    return regressions
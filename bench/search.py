@@ -0,0 +1,80 @@
+"""Time full-text search (FTS5) and the naive LIKE query on the same words"""
+import time
+
+from .report import percentile
+from .seed import WORDS
+
+
+def terms() -> list[str]:
+    """A frequent, a common and a rare word of the seeded posts"""
+    return [WORDS[0], WORDS[len(WORDS) // 10], WORDS[-1]]
+
+
+def _timed(search, searches: int):
+    latencies = []
+    for _ in range(searches):
+        start = time.perf_counter()
+        results = search()
+        latencies.append(time.perf_counter() - start)
+    return sorted(latencies), results
+
+
+def compare_queries(searches: int, limit: int) -> dict:
+    """
+    p50/p95 latency of a first page of search results with crud.search_posts
+    on posts_fts, and with LIKE '%term%' on the content of posts, newest
+    first. Also counts all the posts each of them matches.
+    """
+    from sqlalchemy import func
+
+    from src import crud, models, search
+    from src.database import SessionLocal, engine
+
+    if not search.enable(engine):
+        raise SystemExit("Full-text search needs SQLite with FTS5")
+
+    results = {}
+    with SessionLocal() as db:
+        for term in terms():
+            like = models.Post.content.like(f"%{term}%")
+
+            def naive():
+                return (
+                    db.query(models.Post)
+                    .filter(like)
+                    .order_by(models.Post.id.desc())
+                    .limit(limit)
+                    .all()
+                )
+
+            result = results[term] = {}
+            latencies, _ = _timed(
+                lambda: crud.search_posts(db, [term], limit=limit), searches
+            )
+            result["fts_p50_ms"] = percentile(latencies, 0.50) * 1000
+            result["fts_p95_ms"] = percentile(latencies, 0.95) * 1000
+            latencies, _ = _timed(naive, searches)
+            result["like_p50_ms"] = percentile(latencies, 0.50) * 1000
+            result["like_p95_ms"] = percentile(latencies, 0.95) * 1000
+            result["speedup"] = result["like_p50_ms"] / result["fts_p50_ms"]
+            match = search.posts_fts.c.content.match(search.match_expression([term]))
+            fts_count = db.query(func.count()).select_from(search.posts_fts)
+            result["fts_matches"] = fts_count.filter(match).scalar()
+            result["like_matches"] = (
+                db.query(func.count(models.Post.id)).filter(like).scalar()
+            )
+    return results
+
+
+def print_results(results: dict):
+    print(
+        f"{'term':10} {'fts p50':>8} {'like p50':>9} {'fts p95':>8} "
+        f"{'like p95':>9} {'speedup':>8} {'matches (fts/like)':>19}"
+    )
+    for term, result in results.items():
+        print(
+            f"{term:10} {result['fts_p50_ms']:8.2f} {result['like_p50_ms']:9.2f} "
+            f"{result['fts_p95_ms']:8.2f} {result['like_p95_ms']:9.2f} "
+            f"{result['speedup']:7.2f}x "
+            f"{result['fts_matches']:>9}/{result['like_matches']}"
+        )
@@ -0,0 +1,252 @@
+"""
+Fill a database with users, posts and a skewed reaction distribution.
+
+Rows are generated by a pool of worker processes, one range of ids per task,
+and written by this process in executemany batches, one transaction per
+task: SQLite has a single writer. A post is generated together with its
+reactions, so its counters are inserted with it instead of being recomputed
+from the reactions table. The secondary indexes are dropped during the load
+and built once at the end, like the search index.
+"""
+import math
+import os
+import random
+from collections import deque
+from itertools import accumulate
+from multiprocessing import Pool
+
+from src import migrations, models, search, security
+from src.database import engine
+
+PASSWORD = "benchmark"
+BATCH_SIZE = 10_000
+USERS_PER_TASK = 100_000
+# Posts generated by one task, with their reactions: at most this many
+# posts, fewer once they are expected to get REACTIONS_PER_TASK reactions
+POSTS_PER_TASK = 10_000
+REACTIONS_PER_TASK = 200_000
+WORDS_PER_POST = 8
+# Made up words of post contents, the first ones the most frequent
+SYLLABLES = ["ka", "lo", "mi", "ne", "ru", "sa", "ti", "vo", "ze", "pa", "do", "fe"]
+WORDS = [
+    first + second + third
+    for first in SYLLABLES[:6]
+    for second in SYLLABLES
+    for third in SYLLABLES[6:]
+]
+
+USER_COLUMNS = ("id", "username", "hashed_password")
+POST_COLUMNS = (
+    "id",
+    "content",
+    "author_id",
+    "likes_count",
+    "dislikes_count",
+    "revision",
+)
+REACTION_COLUMNS = ("from_id", "post_id", "is_like")
+
+
+def username(user_id: int) -> str:
+    return f"bench{user_id}"
+
+
+def zipf_weights(count: int, exponent: float) -> list[float]:
+    """Popularity of the i-th item is proportional to 1 / (i + 1) ** exponent"""
+    return [1 / (rank + 1) ** exponent for rank in range(count)]
+
+
+_WORD_CUM_WEIGHTS = list(accumulate(zipf_weights(len(WORDS), 1.0)))
+
+
+def _user_rows(start: int, stop: int, hashed_password: str) -> list[tuple]:
+    return [
+        (user_id, username(user_id), hashed_password)
+        for user_id in range(start, stop)
+    ]
+
+
+def _expected_reactions(plan: dict, post_id: int) -> float:
+    rank = plan["posts"] - post_id
+    return plan["reactions"] / plan["total_weight"] / (rank + 1) ** plan["exponent"]
+
+
+def _post_ranges(plan: dict) -> list[tuple[int, int]]:
+    """Ranges of posts of the tasks, the newest ones get most reactions"""
+    ranges = []
+    start = 1
+    reactions = 0.0
+    for post_id in range(1, plan["posts"] + 1):
+        reactions += min(_expected_reactions(plan, post_id), plan["users"] - 1)
+        if post_id + 1 - start >= POSTS_PER_TASK or reactions >= REACTIONS_PER_TASK:
+            ranges.append((start, post_id + 1))
+            start = post_id + 1
+            reactions = 0.0
+    if start <= plan["posts"]:
+        ranges.append((start, plan["posts"] + 1))
+    return ranges
+
+
+def _post_rows(start: int, stop: int, plan: dict) -> tuple[list, list]:
+    """
+    Posts start..stop-1 and their reactions. The popularity of a post
+    follows its rank, the newest first, and its expected number of
+    reactions is rounded up or down at random so that the totals add up.
+    """
+    # Seeded by the range, so the rows don't depend on the number of processes
+    rng = random.Random(f"{plan['random_seed']}:posts:{start}")
+    # Apart, so that the users, posts and reactions don't depend on the words
+    words_rng = random.Random(f"{plan['random_seed']}:words:{start}")
+    users = plan["users"]
+    post_rows = []
+    reaction_rows = []
+    for post_id in range(start, stop):
+        author_id = rng.randint(1, users)
+        expected = _expected_reactions(plan, post_id)
+        wanted = min(int(expected) + (rng.random() < expected % 1), users - 1)
+        likes = 0
+        if wanted > 0:
+            # One extra candidate in case the author is drawn. Sampled without
+            # replacement: at most one reaction per user, as from_to requires
+            candidates = rng.sample(range(1, users + 1), min(wanted + 1, users))
+            reactors = [from_id for from_id in candidates if from_id != author_id]
+            for from_id in reactors[:wanted]:
+                is_like = rng.random() < 0.8
+                likes += is_like
+                reaction_rows.append((from_id, post_id, is_like))
+        content = " ".join(
+            words_rng.choices(WORDS, cum_weights=_WORD_CUM_WEIGHTS, k=WORDS_PER_POST)
+        )
+        post_rows.append(
+            (
+                post_id,
+                f"Benchmark post {post_id}: {content}",
+                author_id,
+                likes,
+                max(wanted, 0) - likes,
+                0,
+            )
+        )
+    return post_rows, reaction_rows
+
+
+def _generate(pool, func, tasks, ahead: int):
+    """
+    func(*task) of every task in order, computed by the pool at most ahead
+    tasks in advance, so that generated rows don't pile up in memory
+    """
+    if pool is None:
+        for task in tasks:
+            yield func(*task)
+        return
+    pending = deque()
+    for task in tasks:
+        pending.append(pool.apply_async(func, task))
+        if len(pending) >= ahead:
+            yield pending.popleft().get()
+    while pending:
+        yield pending.popleft().get()
+
+
+def _insert(connection, table, columns: tuple, rows: list[tuple]):
+    statement = table.insert()
+    compiled = statement.compile(dialect=connection.dialect, column_keys=columns)
+    # Tuples straight to the driver when it takes them in this order
+    positional = compiled.positional and tuple(compiled.positiontup) == columns
+    for start in range(0, len(rows), BATCH_SIZE):
+        batch = rows[start:start + BATCH_SIZE]
+        if positional:
+            connection.exec_driver_sql(str(compiled), batch)
+        else:
+            connection.execute(statement, [dict(zip(columns, row)) for row in batch])
+
+
+def _user_ranges(users: int) -> list[tuple[int, int]]:
+    return [
+        (start, min(start + USERS_PER_TASK, users + 1))
+        for start in range(1, users + 1, USERS_PER_TASK)
+    ]
+
+
+def _secondary_indexes() -> list:
+    """Indexes of the seeded tables, apart from their unique constraints"""
+    return [
+        index
+        for model in (models.User, models.Post, models.Reaction)
+        for index in model.__table__.indexes
+        if not index.unique
+    ]
+
+
+def seed(
+    users: int,
+    posts: int,
+    reactions: int,
+    exponent: float = 1.1,
+    random_seed=0,
+    processes: int | None = None,
+    hashed_password: str | None = None,
+):
+    """
+    Create users bench1..benchN sharing one password hash, posts with random
+    authors and words, and reactions to posts chosen with Zipf-like
+    popularity. Expects empty tables. processes generate the rows, 0 to
+    generate them in this process, the number of CPUs by default.
+    hashed_password is given to every user instead of a fresh hash of PASSWORD.
+    """
+    migrations.migrate(engine)
+    if hashed_password is None:
+        hashed_password = security.get_password_hash(PASSWORD)
+    if processes is None:
+        processes = os.cpu_count() or 1
+    plan = {
+        "users": users,
+        "posts": posts,
+        "reactions": reactions,
+        "exponent": exponent,
+        "random_seed": random_seed,
+        "total_weight": math.fsum(zipf_weights(posts, exponent)),
+    }
+    counts = {"users": 0, "posts": 0, "reactions": 0}
+
+    indexes = _secondary_indexes()
+    with engine.begin() as connection:
+        for index in indexes:
+            index.drop(bind=connection, checkfirst=True)
+    pool = Pool(processes) if processes else None
+    try:
+        user_tasks = [
+            (start, stop, hashed_password)
+            for start, stop in _user_ranges(users)
+        ]
+        for rows in _generate(pool, _user_rows, user_tasks, 2 * processes):
+            with engine.begin() as connection:
+                _insert(connection, models.User.__table__, USER_COLUMNS, rows)
+            counts["users"] += len(rows)
+
+        post_tasks = [(start, stop, plan) for start, stop in _post_ranges(plan)]
+        for post_rows, reaction_rows in _generate(
+            pool, _post_rows, post_tasks, 2 * processes
+        ):
+            with engine.begin() as connection:
+                _insert(connection, models.Post.__table__, POST_COLUMNS, post_rows)
+                _insert(
+                    connection,
+                    models.Reaction.__table__,
+                    REACTION_COLUMNS,
+                    reaction_rows,
+                )
+            counts["posts"] += len(post_rows)
+            counts["reactions"] += len(reaction_rows)
+    finally:
+        if pool is not None:
+            pool.terminate()
+        with engine.begin() as connection:
+            for index in indexes:
+                index.create(bind=connection, checkfirst=True)
+
+    # Posts were inserted without crud, index them for search
+    if search.enable(engine):
+        with engine.begin() as connection:
+            search.rebuild(connection)
+    return counts
@@ -0,0 +1,71 @@
+"""Time the default and the fast serialization paths on the same requests"""
+import time
+
+import httpx
+from pydantic import parse_obj_as
+
+from .report import percentile
+
+
+def endpoints() -> dict:
+    from src import schemas
+
+    return {
+        "feed": ("/posts/?limit=100", list[schemas.Post]),
+        "users": ("/users/?limit=100", list[schemas.User]),
+        "post": ("/posts/1/", schemas.Post),
+        "user": ("/users/1/", schemas.User),
+    }
+
+
+async def _timed(client: httpx.AsyncClient, path: str, requests: int):
+    latencies = []
+    for _ in range(requests):
+        start = time.perf_counter()
+        response = await client.get(path)
+        latencies.append(time.perf_counter() - start)
+        response.raise_for_status()
+    return sorted(latencies), response
+
+
+async def compare_paths(requests: int) -> dict:
+    """
+    p50/p95 latency of every endpoint with FAST_SERIALIZATION off and on.
+    Also checks that both paths give the same headers and body, and that the
+    fast one validates against the response model.
+    """
+    from src import serializers
+    from src.main import app
+
+    results = {}
+    async with httpx.AsyncClient(app=app, base_url="http://bench") as client:
+        for name, (path, model) in endpoints().items():
+            result = results[name] = {"path": path}
+            responses = {}
+            for fast in (False, True):
+                serializers.FAST_SERIALIZATION = fast
+                latencies, responses[fast] = await _timed(client, path, requests)
+                label = "fast" if fast else "default"
+                result[f"{label}_p50_ms"] = percentile(latencies, 0.50) * 1000
+                result[f"{label}_p95_ms"] = percentile(latencies, 0.95) * 1000
+            parse_obj_as(model, responses[True].json())
+            result["same_output"] = (
+                responses[False].json() == responses[True].json()
+                and responses[False].headers.get("x-next-cursor")
+                == responses[True].headers.get("x-next-cursor")
+            )
+            result["speedup"] = result["default_p50_ms"] / result["fast_p50_ms"]
+    return results
+
+
+def print_results(results: dict):
+    print(
+        f"{'endpoint':10} {'default p50':>12} {'fast p50':>10} "
+        f"{'default p95':>12} {'fast p95':>10} {'speedup':>8}  same output"
+    )
+    for name, result in results.items():
+        print(
+            f"{name:10} {result['default_p50_ms']:12.2f} {result['fast_p50_ms']:10.2f} "
+            f"{result['default_p95_ms']:12.2f} {result['fast_p95_ms']:10.2f} "
+            f"{result['speedup']:7.2f}x  {result['same_output']}"
+        )
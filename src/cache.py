@@ -0,0 +1,277 @@
+"""
+Cache backends.
+
+Keys are (int, int) pairs, values are anything that survives a JSON round
+trip as a list/tuple or None. Both backends count hits, misses and
+evictions for their process.
+
+Shared caches hold rows of the app's database but outlive its processes:
+by default their file is named after the database URL and the instance id
+written by migrations, so a new or reset database never reads the entries
+of another one. The app also empties them at startup and after `migrate`.
+"""
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from contextlib import closing
+from functools import partial
+from typing import Callable
+
+
+class CacheBackend:
+    """Interface of cache storages"""
+
+    def __init__(self, max_size: int, ttl: float | None = None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, default=None):
+        raise NotImplementedError
+
+    def __setitem__(self, key, value):
+        raise NotImplementedError
+
+    def discard(self, key):
+        raise NotImplementedError
+
+    def discard_first(self, value: int):
+        """Drop every key whose first element is value"""
+        raise NotImplementedError
+
+    def discard_second(self, values):
+        """Drop every key whose second element is in values"""
+        raise NotImplementedError
+
+    def clear(self):
+        raise NotImplementedError
+
+    def __len__(self):
+        raise NotImplementedError
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+        }
+
+
+class LRUCache(CacheBackend):
+    """In-process mapping with a size limit, LRU eviction and optional TTL"""
+
+    def __init__(self, max_size: int, ttl: float | None = None):
+        super().__init__(max_size, ttl)
+        self._data = OrderedDict()  # key -> (expires_at, value)
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                expires_at, value = self._data[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            if expires_at is not None and expires_at < time.monotonic():
+                del self._data[key]
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def __setitem__(self, key, value):
+        expires_at = None if self.ttl is None else time.monotonic() + self.ttl
+        with self._lock:
+            self._data[key] = (expires_at, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def discard(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def _discard_where(self, predicate):
+        with self._lock:
+            for key in [key for key in self._data if predicate(key)]:
+                del self._data[key]
+
+    def discard_first(self, value: int):
+        self._discard_where(lambda key: key[0] == value)
+
+    def discard_second(self, values):
+        values = set(values)
+        self._discard_where(lambda key: key[1] in values)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+class SQLiteCache(CacheBackend):
+    """
+    Cache shared by all processes on one host through a SQLite file.
+
+    Every worker reads and writes the same table, so a write or an
+    invalidation made by one worker is seen by all others on their next
+    lookup. Eviction drops the least recently written entries; lookups do
+    not write, to keep readers off the SQLite write lock.
+    """
+
+    TRIM_EVERY = 256  # writes between size checks
+
+    def __init__(
+        self,
+        path: str | Callable[[], str],
+        max_size: int,
+        ttl: float | None = None,
+    ):
+        """path may be a function, called on first use"""
+        super().__init__(max_size, ttl)
+        self._path = path
+        self._local = threading.local()
+        self._writes = 0
+
+    @property
+    def path(self) -> str:
+        if callable(self._path):
+            self._path = self._path()
+        return self._path
+
+    def _connection(self) -> sqlite3.Connection:
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=OFF")
+            _create_table(connection)
+            self._local.connection = connection
+        return connection
+
+    def get(self, key, default=None):
+        row = self._connection().execute(
+            "SELECT value FROM cache WHERE first = ? AND second = ? "
+            "AND (expires_at IS NULL OR expires_at > ?)",
+            (*key, time.time()),
+        ).fetchone()
+        if row is None:
+            self.misses += 1
+            return default
+        self.hits += 1
+        value = json.loads(row[0])
+        # JSON turned tuples into lists
+        return tuple(value) if isinstance(value, list) else value
+
+    def __setitem__(self, key, value):
+        now = time.time()
+        expires_at = None if self.ttl is None else now + self.ttl
+        self._connection().execute(
+            "INSERT OR REPLACE INTO cache VALUES (?, ?, ?, ?, ?)",
+            (*key, json.dumps(value), expires_at, now),
+        )
+        self._writes += 1
+        if self._writes % self.TRIM_EVERY == 0:
+            self._trim()
+
+    def _trim(self):
+        excess = len(self) - self.max_size
+        if excess > 0:
+            self._connection().execute(
+                "DELETE FROM cache WHERE (first, second) IN ("
+                "SELECT first, second FROM cache ORDER BY written_at LIMIT ?)",
+                (excess,),
+            )
+            self.evictions += excess
+
+    def discard(self, key):
+        self._connection().execute(
+            "DELETE FROM cache WHERE first = ? AND second = ?", key
+        )
+
+    def discard_first(self, value: int):
+        self._connection().execute("DELETE FROM cache WHERE first = ?", (value,))
+
+    def discard_second(self, values):
+        values = list(values)
+        if values:
+            placeholders = ", ".join("?" * len(values))
+            self._connection().execute(
+                f"DELETE FROM cache WHERE second IN ({placeholders})", values
+            )
+
+    def clear(self):
+        self._connection().execute("DELETE FROM cache")
+
+    def __len__(self):
+        return self._connection().execute("SELECT count(*) FROM cache").fetchone()[0]
+
+
+def _create_table(connection: sqlite3.Connection):
+    connection.execute(
+        "CREATE TABLE IF NOT EXISTS cache ("
+        "first INTEGER NOT NULL, second INTEGER NOT NULL, value TEXT, "
+        "expires_at REAL, written_at REAL NOT NULL, "
+        "PRIMARY KEY (first, second)) WITHOUT ROWID"
+    )
+    connection.execute("CREATE INDEX IF NOT EXISTS cache_second ON cache (second)")
+    connection.execute(
+        "CREATE INDEX IF NOT EXISTS cache_written_at ON cache (written_at)"
+    )
+
+
+def default_cache_path(name: str) -> str:
+    """A file in /dev/shm when available, so the shared cache stays in RAM"""
+    directory = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+    return os.path.join(directory, f"{name}.sqlite")
+
+
+def database_cache_path(name: str) -> str:
+    """default_cache_path of a cache of the app's database, see above"""
+    # migrations import crud, which imports the caches
+    from . import database, migrations
+
+    key = migrations.instance_key(database.engine)
+    return default_cache_path(f"{name}-{key}")
+
+
+def clear_file(path: str):
+    """Empty the shared cache stored at path, if there is one"""
+    if os.path.exists(path):
+        with closing(sqlite3.connect(path, timeout=5)) as connection:
+            _create_table(connection)
+            connection.execute("DELETE FROM cache")
+            connection.commit()
+
+
+def make_cache(
+    backend: str,
+    max_size: int,
+    ttl: float | None = None,
+    path: str | None = None,
+    name: str = "cache",
+) -> CacheBackend:
+    """
+    Build a cache backend by name: "memory" or "sqlite", in the file at path
+    or by default in the database_cache_path of name
+    """
+    if backend == "memory":
+        return LRUCache(max_size, ttl)
+    if backend == "sqlite":
+        path = path or partial(database_cache_path, name)
+        return SQLiteCache(path, max_size, ttl)
+    raise ValueError(f"Unknown cache backend: {backend}")
@@ -1,115 +1,708 @@
-from sqlalchemy.orm import Session
+from sqlalchemy import (
+    and_,
+    case,
+    func,
+    literal,
+    or_,
+    select,
+    tuple_,
+    union_all,
+    update,
+)
+from sqlalchemy.dialects import mysql, postgresql, sqlite
+from sqlalchemy.orm import Session, selectinload
+from sqlalchemy.orm.attributes import set_committed_value
 
-from . import models, schemas, reaction_cache
+from . import models, schemas, feed_cache, reaction_buffer, reaction_cache
+from . import search, token_cache
 from .security import get_password_hash
 
 def get_user(db: Session, user_id: int):
-    return db.query(models.User).filter(models.User.id == user_id).first()
+    return (
+        db.query(models.User)
+        .options(selectinload(models.User.recent_posts))
+        .filter(models.User.id == user_id)
+        .first()
+    )
+
+
+def get_user_by_id(db: Session, user_id: int):
+    """User without the posts, to authorize a request"""
+    return db.get(models.User, user_id)
 
 
 def get_user_by_username(db: Session, username: str):
     return db.query(models.User).filter(models.User.username == username).first()
 
 
-def get_users(db: Session, skip: int = 0, limit: int = 100):
-    return db.query(models.User).offset(skip).limit(limit).all()
+def _keyset_page(
+    query,
+    column,
+    limit: int,
+    after: int | None,
+    before: int | None,
+    descending: bool = True,
+):
+    """Page of query ordered by column that starts right after/before a cursor"""
+    forward, backward = (column.desc(), column.asc())
+    if not descending:
+        forward, backward = backward, forward
+    if before is not None:
+        query = query.filter(column > before if descending else column < before)
+        return list(reversed(query.order_by(backward).limit(limit).all()))
+    if after is not None:
+        query = query.filter(column < after if descending else column > after)
+    return query.order_by(forward).limit(limit).all()
+
+
+def get_users(
+    db: Session,
+    skip: int = 0,
+    limit: int = 100,
+    after: int | None = None,
+    before: int | None = None,
+):
+    query = db.query(models.User).options(selectinload(models.User.recent_posts))
+    return _users_page(query, skip, limit, after, before)
+
+
+def _users_page(query, skip: int, limit: int, after: int | None, before: int | None):
+    if after is not None or before is not None:
+        return _keyset_page(
+            query, models.User.id, limit, after, before, descending=False
+        )
+    return query.order_by(models.User.id).offset(skip).limit(limit).all()
+
+
+def _post_columns(entity=models.Post):
+    return (
+        entity.id,
+        entity.content,
+        entity.author_id,
+        entity.likes_count,
+        entity.dislikes_count,
+        entity.revision,
+    )
+
+
+def get_recent_post_rows(db: Session, user_ids: list[int]) -> dict:
+    """Column rows of User.recent_posts of several users, by author id"""
+    posts = {user_id: [] for user_id in user_ids}
+    if user_ids:
+        rows = (
+            db.query(*_post_columns())
+            .select_from(models.User)
+            .join(models.User.recent_posts)
+            .filter(models.User.id.in_(user_ids))
+            .order_by(models.Post.id.desc())
+        )
+        for row in rows:
+            posts[row.author_id].append(row)
+    return posts
+
+
+def get_user_rows(
+    db: Session,
+    skip: int = 0,
+    limit: int = 100,
+    after: int | None = None,
+    before: int | None = None,
+):
+    """Like get_users, as column rows: (users, recent posts by author id)"""
+    query = db.query(models.User.id, models.User.username)
+    users = _users_page(query, skip, limit, after, before)
+    return users, get_recent_post_rows(db, [user.id for user in users])
 
 
-def create_user(db: Session, user: schemas.UserCredentials):
-    hashed_password = get_password_hash(user.password)
+def create_user(
+    db: Session, user: schemas.UserCredentials, hashed_password: str | None = None
+):
+    if hashed_password is None:
+        hashed_password = get_password_hash(user.password)
     db_user = models.User(username=user.username, hashed_password=hashed_password)
     db.add(db_user)
     db.commit()
-    db.refresh(db_user)
+    # The INSERT set the id, nothing to refresh.
+    # A new user has no posts, no need to lazy-load them during serialization
+    set_committed_value(db_user, "recent_posts", [])
     return db_user
 
 
-def update_user(db: Session, user: models.User, NewCreds: schemas.UserCredentials):
-    hashed_password = get_password_hash(NewCreds.password)
+@token_cache.forget_user_tokens
+def update_user(
+    db: Session,
+    user: models.User,
+    NewCreds: schemas.UserCredentials,
+    hashed_password: str | None = None,
+):
+    if hashed_password is None:
+        hashed_password = get_password_hash(NewCreds.password)
     user.hashed_password = hashed_password
     user.username = NewCreds.username
     db.add(user)
     db.commit()
-    db.refresh(user)
+    # The user is up to date, only load the posts, a part of the response
+    recent_posts = (
+        db.query(models.Post)
+        .filter(models.Post.author_id == user.id)
+        .order_by(models.Post.id.desc())
+        .limit(models.USER_RECENT_POSTS)
+        .all()
+    )
+    set_committed_value(user, "recent_posts", recent_posts)
     return user
 
 
+@feed_cache.invalidate_all
+@token_cache.forget_user_tokens
+@reaction_cache.delete_user_from_cache
 def delete_user(db: Session, user: models.User):
-    db.delete(user)
+    # Withdraw the user's reactions from other people's posts.
+    # from_to guarantees at most one reaction per post.
+    for is_like in (True, False):
+        column = models.Post.likes_count if is_like else models.Post.dislikes_count
+        reacted_posts = select(models.Reaction.post_id).where(
+            models.Reaction.from_id == user.id,
+            models.Reaction.is_like == is_like,
+        )
+        db.query(models.Post).filter(models.Post.id.in_(reacted_posts)).update(
+            {column: column - 1, models.Post.revision: models.Post.revision + 1},
+            synchronize_session=False,
+        )
+    user_posts = select(models.Post.id).where(models.Post.author_id == user.id)
+    search.unindex_posts(db, user_posts)
+    # Bulk deletes rather than the ORM cascade, which loads the reactions
+    # of every post: the statements don't grow with the user's posts
+    db.query(models.Reaction).filter(
+        or_(
+            models.Reaction.from_id == user.id,
+            models.Reaction.post_id.in_(user_posts),
+        )
+    ).delete(synchronize_session=False)
+    db.query(models.Post).filter(models.Post.author_id == user.id).delete(
+        synchronize_session=False
+    )
+    db.query(models.User).filter(models.User.id == user.id).delete(
+        synchronize_session=False
+    )
     db.commit()
 
 
-def get_posts(db: Session, skip: int = 0, limit: int = 100):
-    return (
-        db.query(models.Post)
-        .order_by(models.Post.id.desc())
-        .offset(skip)
-        .limit(limit)
-        .all()
-    )
+def get_posts(
+    db: Session,
+    skip: int = 0,
+    limit: int = 100,
+    after: int | None = None,
+    before: int | None = None,
+):
+    return _posts_page(db.query(models.Post), skip, limit, after, before)
+
+
+def get_post_rows(
+    db: Session,
+    skip: int = 0,
+    limit: int = 100,
+    after: int | None = None,
+    before: int | None = None,
+):
+    """Like get_posts, as column rows"""
+    query = db.query(*_post_columns())
+    return _posts_page(query, skip, limit, after, before)
+
+
+def _posts_page(query, skip: int, limit: int, after: int | None, before: int | None):
+    if after is not None or before is not None:
+        return _keyset_page(query, models.Post.id, limit, after, before)
+    return query.order_by(models.Post.id.desc()).offset(skip).limit(limit).all()
+
+
+def get_user_posts(
+    db: Session,
+    user_id: int,
+    skip: int = 0,
+    limit: int = 100,
+    after: int | None = None,
+    before: int | None = None,
+):
+    query = db.query(models.Post).filter(models.Post.author_id == user_id)
+    return _posts_page(query, skip, limit, after, before)
+
+
+def get_user_post_rows(
+    db: Session,
+    user_id: int,
+    skip: int = 0,
+    limit: int = 100,
+    after: int | None = None,
+    before: int | None = None,
+):
+    """Like get_user_posts, as column rows"""
+    query = db.query(*_post_columns()).filter(models.Post.author_id == user_id)
+    return _posts_page(query, skip, limit, after, before)
+
+
+def get_timeline(
+    db: Session,
+    author_ids: list[int],
+    skip: int = 0,
+    limit: int = 100,
+    after: int | None = None,
+    before: int | None = None,
+):
+    """
+    Posts of several authors merged, newest first, in one query. SQLite
+    reads ix_posts_author_id_id of every author newest first and stops each
+    as soon as its posts can't make the page, so prolific authors are cheap.
+    """
+    query = db.query(models.Post).filter(models.Post.author_id.in_(author_ids))
+    return _posts_page(query, skip, limit, after, before)
+
+
+def get_timeline_rows(
+    db: Session,
+    author_ids: list[int],
+    skip: int = 0,
+    limit: int = 100,
+    after: int | None = None,
+    before: int | None = None,
+):
+    """Like get_timeline, as column rows"""
+    query = db.query(*_post_columns()).filter(models.Post.author_id.in_(author_ids))
+    return _posts_page(query, skip, limit, after, before)
 
 
 def get_post_by_id(db: Session, post_id: int):
     return db.query(models.Post).filter(models.Post.id == post_id).first()
 
 
+@feed_cache.invalidate_new_post
 def create_post(db: Session, post: schemas.NewPost, user_id: int):
     db_post = models.Post(**post.dict(), author_id=user_id)
     db.add(db_post)
+    search.index_post(db, db_post)
     db.commit()
-    db.refresh(db_post)
+    # The INSERT set the id, and the counters to their defaults
     return db_post
 
 
+def _returning(db: Session) -> bool:
+    """Whether the database returns columns of UPDATEd rows"""
+    return db.get_bind().dialect.full_returning
+
+
+@feed_cache.invalidate_post
 def update_post(db: Session, content: schemas.NewPost, post: models.Post):
-    for key, value in content.dict().items():
-        setattr(post, key, value)
-    db.add(post)
+    values = content.dict()
+    statement = (
+        update(models.Post)
+        .where(models.Post.id == post.id)
+        .values(**values, revision=models.Post.revision + 1)
+        .execution_options(synchronize_session=False)
+    )
+    generated = {}
+    if _returning(db):
+        # Counters may have changed since the post was loaded
+        statement = statement.returning(
+            models.Post.likes_count, models.Post.dislikes_count, models.Post.revision
+        )
+        generated = db.execute(statement).one()._asdict()
+    else:
+        db.execute(statement)
+    search.reindex_post(db, post.id, values["content"])
     db.commit()
-    db.refresh(post)
+    for key, value in {**values, **generated}.items():
+        set_committed_value(post, key, value)
+    if not generated:
+        # Bumped by the database: reloaded if read, which responses don't
+        db.expire(post, ["revision"])
     return post
 
 
+@feed_cache.invalidate_deleted_post
+@reaction_cache.delete_post_from_cache
 def delete_post(db: Session, post: models.Post):
-    db.delete(post)
+    search.unindex_posts(db, [post.id])
+    # Without loading the reactions for the ORM cascade, like delete_user
+    db.query(models.Reaction).filter(models.Reaction.post_id == post.id).delete(
+        synchronize_session=False
+    )
+    db.query(models.Post).filter(models.Post.id == post.id).delete(
+        synchronize_session=False
+    )
     db.commit()
 
+
+def search_posts(
+    db: Session,
+    search_terms: list[str],
+    limit: int = 50,
+    after: tuple[float, int] | None = None,
+) -> list[tuple]:
+    """
+    Posts containing every term, best match first, as (post, rank): the
+    bm25 of the match among the newest search.SEARCH_RANK_WINDOW matches,
+    then older matches newest first with rank 0, or 0 for every match
+    without full-text search. after is the (rank, id) of the last post of
+    the previous page. Reaction counts are columns of posts, loaded with them.
+    """
+    if not search.FTS5:
+        query = db.query(models.Post, literal(0.0))
+        for term in search_terms:
+            term = term.replace("_", "\\_")  # The only LIKE wildcard in a term
+            query = query.filter(models.Post.content.ilike(f"%{term}%", escape="\\"))
+        if after is not None:
+            query = query.filter(models.Post.id < after[1])
+        return query.order_by(models.Post.id.desc()).limit(limit).all()
+
+    fts = search.posts_fts
+    expression = search.match_expression(search_terms)
+    # Walking matches by rowid is cheap, scoring them is not
+    newest = fts.alias("newest")
+    newest_matches = (
+        select(newest.c.rowid)
+        .where(newest.c.content.match(expression))
+        .order_by(newest.c.rowid.desc())
+        .limit(search.SEARCH_RANK_WINDOW)
+        .subquery()
+    )
+    window_start = select(func.min(newest_matches.c.rowid)).scalar_subquery()
+
+    def page(rank, in_window):
+        """limit matches of one part past the cursor, in result order"""
+        query = select(fts.c.rowid.label("id"), rank.label("rank")).where(
+            fts.c.content.match(expression), in_window
+        )
+        if after is not None:
+            after_rank, after_id = after
+            query = query.where(
+                or_(
+                    rank > after_rank,
+                    and_(rank == after_rank, fts.c.rowid < after_id),
+                )
+            )
+        query = query.order_by(rank, fts.c.rowid.desc()).limit(limit)
+        return select(query.subquery())
+
+    # bm25 is negative: older matches, at rank 0, come after the window, and
+    # a cursor in either part carries on from there
+    matches = union_all(
+        page(fts.c.rank, fts.c.rowid >= window_start),
+        page(literal(0.0), fts.c.rowid < window_start),
+    ).subquery()
+    return (
+        db.query(models.Post, matches.c.rank)
+        .join(matches, matches.c.id == models.Post.id)
+        .order_by(matches.c.rank, models.Post.id.desc())
+        .limit(limit)
+        .all()
+    )
+
+
+def _count_reaction(
+    db: Session, post_id: int, from_id: int, is_like: bool | None
+) -> bool:
+    """
+    Move the post's counters from the stored reaction of user from_id to
+    is_like, None for no reaction, in one UPDATE reading the stored reaction
+    in a subquery. Returns False, having changed nothing, if the stored
+    reaction already is is_like.
+    """
+    stored = (
+        select(models.Reaction.is_like)
+        .where(models.Reaction.from_id == from_id, models.Reaction.post_id == post_id)
+        .scalar_subquery()
+    )
+    updated = (
+        db.query(models.Post)
+        .filter(models.Post.id == post_id, stored.is_distinct_from(is_like))
+        .update(
+            {
+                models.Post.likes_count: models.Post.likes_count
+                + int(is_like is True)
+                - case((stored.is_(True), 1), else_=0),
+                models.Post.dislikes_count: models.Post.dislikes_count
+                + int(is_like is False)
+                - case((stored.is_(False), 1), else_=0),
+                models.Post.revision: models.Post.revision + 1,
+            },
+            synchronize_session=False,
+        )
+    )
+    return updated > 0
+
+
+def reactions_counts_update():
+    """UPDATE of the counters of all posts from the reactions table"""
+
+    def count(is_like: bool):
+        return (
+            select(func.count(models.Reaction.id))
+            .where(
+                models.Reaction.post_id == models.Post.id,
+                models.Reaction.is_like == is_like,
+            )
+            .scalar_subquery()
+        )
+
+    return update(models.Post.__table__).values(
+        {
+            models.Post.likes_count: count(True),
+            models.Post.dislikes_count: count(False),
+            models.Post.revision: models.Post.revision + 1,
+        }
+    )
+
+
+def reconcile_reactions_counts(db: Session) -> int:
+    """Recompute the counters of all posts from the reactions table"""
+    updated = db.execute(reactions_counts_update()).rowcount
+    db.commit()
+    return updated
+
+
+@feed_cache.invalidate_reacted_post
 @reaction_cache.update_reaction_cache
 def add_reaction(
-    db: Session, is_like: bool, post: models.Post, user: models.User
+    db: Session, is_like: bool, post: models.Post, user: schemas.CurrentUser
 ) -> models.Reaction | None:
-    reaction = get_reaction(db, post, user)
-    if reaction is None:
-        reaction = models.Reaction(from_id=user.id, post_id=post.id, is_like=is_like)
-        db.add(reaction)
+    """
+    Like or dislike post, replacing the opposite reaction: one counters
+    UPDATE then one upsert. Returns None if the reaction already was is_like.
+    """
+    if not _count_reaction(db, post.id, user.id, is_like):
         db.commit()
-        db.refresh(reaction)
-        return reaction
-
-    if reaction.is_like != is_like:
-        return update_reaction(db, reaction, is_like)
-    return None  # If user's previous reaction is same
-
-@reaction_cache.update_reaction_cache
-def update_reaction(
-    db: Session, reaction: models.Reaction, is_like: bool
-) -> models.Reaction:
-    reaction.is_like = is_like
-    db.add(reaction)
+        return None
+    reaction = {"from_id": user.id, "post_id": post.id, "is_like": is_like}
+    _upsert_reactions(db, [reaction])
     db.commit()
-    db.refresh(reaction)
-    return reaction
+    return models.Reaction(**reaction)
+
 
 @reaction_cache.get_from_cache
-def get_reaction(db: Session, post: models.Post, user: models.User):
+def get_reaction(db: Session, post: models.Post, user: schemas.CurrentUser):
     return (
         db.query(models.Reaction)
-        .filter(models.Reaction.post == post)
-        .filter(models.Reaction.user == user)
+        .filter(models.Reaction.post_id == post.id)
+        .filter(models.Reaction.from_id == user.id)
         .first()
     )
 
+
+@feed_cache.invalidate_reacted_post
 @reaction_cache.delete_from_cache
-def delete_reaction(db: Session, reaction: models.Reaction):
-    db.delete(reaction)
+def delete_reaction(
+    db: Session, post: models.Post, user: schemas.CurrentUser
+) -> models.Reaction | None:
+    """
+    Withdraw the user's reaction to post: one counters UPDATE then one
+    DELETE. Returns the deleted reaction, None if there was none.
+    """
+    if not _count_reaction(db, post.id, user.id, None):
+        db.commit()
+        return None
+    db.query(models.Reaction).filter(
+        models.Reaction.from_id == user.id, models.Reaction.post_id == post.id
+    ).delete(synchronize_session=False)
+    db.commit()
+    # Only its keys are known, which is what the decorators need
+    return models.Reaction(from_id=user.id, post_id=post.id)
+
+
+def _upsert_reactions(db: Session, rows: list[dict]):
+    """INSERT rows into reactions, or update is_like on from_to conflicts"""
+    table = models.Reaction.__table__
+    dialect = db.get_bind().dialect.name
+    if dialect == "mysql":
+        statement = mysql.insert(table).values(rows)
+        statement = statement.on_duplicate_key_update(
+            is_like=statement.inserted.is_like
+        )
+    else:
+        insert = postgresql.insert if dialect == "postgresql" else sqlite.insert
+        statement = insert(table).values(rows)
+        statement = statement.on_conflict_do_update(
+            index_elements=[table.c.from_id, table.c.post_id],
+            set_={"is_like": statement.excluded.is_like},
+        )
+    db.execute(statement)
+
+
+def _shift_counter(column, deltas: dict):
+    """column plus the delta of each post id, in one expression"""
+    deltas = {post_id: delta for post_id, delta in deltas.items() if delta}
+    if not deltas:
+        return column
+    return column + case(deltas, value=models.Post.id, else_=0)
+
+
+_BATCH_RESULTS = {
+    "like": ("Success", "Alredy liked"),
+    "dislike": ("Success", "Alredy disliked"),
+    "cancel": ("Success", "Reaction not found"),
+}
+
+
+@feed_cache.invalidate_batch_reactions
+@reaction_cache.forget_batch_reactions
+def apply_reactions(
+    db: Session,
+    operations: list[schemas.ReactionOperation],
+    user: schemas.CurrentUser,
+) -> list[schemas.ReactionResult]:
+    """
+    Apply like/dislike/cancel operations in order, in one transaction:
+    one upsert, one delete and one counters update whatever their number
+    """
+    post_ids = {operation.post_id for operation in operations}
+    authors = dict(
+        db.query(models.Post.id, models.Post.author_id).filter(
+            models.Post.id.in_(post_ids)
+        )
+    )
+    # post_id -> is_like, absent without a reaction
+    before = dict(
+        db.query(models.Reaction.post_id, models.Reaction.is_like).filter(
+            models.Reaction.from_id == user.id,
+            models.Reaction.post_id.in_(authors),
+        )
+    )
+
+    state = dict(before)
+    results = []
+    for operation in operations:
+        changed = False
+        if operation.post_id not in authors:
+            result = "Post not found"
+        elif authors[operation.post_id] == user.id:
+            result = "You can't add reactions to your own posts."
+        else:
+            current = state.get(operation.post_id)
+            if operation.action == "cancel":
+                changed = current is not None
+                state.pop(operation.post_id, None)
+            else:
+                is_like = operation.action == "like"
+                changed = current is not is_like
+                state[operation.post_id] = is_like
+            success, unchanged = _BATCH_RESULTS[operation.action]
+            result = success if changed else unchanged
+        results.append(
+            schemas.ReactionResult(**operation.dict(), result=result, changed=changed)
+        )
+
+    upserts = [
+        {"from_id": user.id, "post_id": post_id, "is_like": is_like}
+        for post_id, is_like in state.items()
+        if before.get(post_id) is not is_like
+    ]
+    deletes = [post_id for post_id in before if post_id not in state]
+    if upserts:
+        _upsert_reactions(db, upserts)
+    if deletes:
+        db.query(models.Reaction).filter(
+            models.Reaction.from_id == user.id,
+            models.Reaction.post_id.in_(deletes),
+        ).delete(synchronize_session=False)
+
+    touched = {row["post_id"] for row in upserts} | set(deletes)
+    _count_reactions(
+        db,
+        [(post_id, before.get(post_id), state.get(post_id)) for post_id in touched],
+    )
+    db.commit()
+    return results
+
+
+def _count_reactions(db: Session, changes: list[tuple]):
+    """
+    Adjust the counters of posts in one UPDATE.
+    changes are (post_id, old is_like, new is_like), None for no reaction.
+    """
+    if not changes:
+        return
+    likes, dislikes = {}, {}
+    for post_id, old, new in changes:
+        likes[post_id] = likes.get(post_id, 0) + (new is True) - (old is True)
+        dislikes[post_id] = dislikes.get(post_id, 0) + (new is False) - (old is False)
+    db.query(models.Post).filter(models.Post.id.in_(likes)).update(
+        {
+            models.Post.likes_count: _shift_counter(models.Post.likes_count, likes),
+            models.Post.dislikes_count: _shift_counter(
+                models.Post.dislikes_count, dislikes
+            ),
+            models.Post.revision: models.Post.revision + 1,
+        },
+        synchronize_session=False,
+    )
+
+
+@feed_cache.invalidate_buffered_reaction
+def buffer_reaction(
+    db: Session, is_like: bool | None, post: models.Post, user: schemas.CurrentUser
+) -> bool:
+    """
+    Write-behind add_reaction, or delete_reaction with is_like=None.
+    Returns whether the reaction changed.
+    """
+    key = (user.id, post.id)
+    stored = reaction_buffer.buffer.state(key)
+    if stored is reaction_buffer.MISSING:
+        reaction = get_reaction(db, post, user)
+        stored = None if reaction is None else reaction.is_like
+    return reaction_buffer.buffer.apply(key, stored, is_like)
+
+
+@reaction_cache.forget_flushed_reactions
+def flush_reactions(db: Session, changes: dict):
+    """
+    Commit buffered reactions: (from_id, post_id) -> [stored, wanted].
+    Reactions of users or to posts deleted meanwhile are dropped, counters
+    are adjusted from the reactions actually stored.
+    """
+    post_ids = {post_id for _, post_id in changes}
+    user_ids = {from_id for from_id, _ in changes}
+    post_ids = {
+        post_id
+        for (post_id,) in db.query(models.Post.id).filter(models.Post.id.in_(post_ids))
+    }
+    user_ids = {
+        user_id
+        for (user_id,) in db.query(models.User.id).filter(models.User.id.in_(user_ids))
+    }
+    wanted = {
+        key: is_like
+        for key, (_, is_like) in changes.items()
+        if key[0] in user_ids and key[1] in post_ids
+    }
+    if not wanted:
+        return
+    pair = tuple_(models.Reaction.from_id, models.Reaction.post_id)
+    stored = {
+        (from_id, post_id): is_like
+        for from_id, post_id, is_like in db.query(
+            models.Reaction.from_id, models.Reaction.post_id, models.Reaction.is_like
+        ).filter(pair.in_(list(wanted)))
+    }
+    upserts = [
+        {"from_id": from_id, "post_id": post_id, "is_like": is_like}
+        for (from_id, post_id), is_like in wanted.items()
+        if is_like is not None and stored.get((from_id, post_id)) is not is_like
+    ]
+    deletes = [
+        key for key, is_like in wanted.items() if is_like is None and key in stored
+    ]
+    if upserts:
+        _upsert_reactions(db, upserts)
+    if deletes:
+        db.query(models.Reaction).filter(pair.in_(deletes)).delete(
+            synchronize_session=False
+        )
+    _count_reactions(
+        db,
+        [
+            (post_id, stored.get((from_id, post_id)), is_like)
+            for (from_id, post_id), is_like in wanted.items()
+            if stored.get((from_id, post_id)) is not is_like
+        ],
+    )
     db.commit()
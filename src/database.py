@@ -1,13 +1,244 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+import itertools
 import os
+import threading
+import time
 
 SQLALCHEMY_DATABASE_URL = os.environ.get('DATABASE_URL') or "sqlite:///./app.db"
+# Read-only copies of the database, comma separated. GET routes read from
+# them in turn, see replicas.py
+DATABASE_REPLICA_URLS = [
+    url.strip()
+    for url in (os.environ.get('DATABASE_REPLICA_URLS') or "").split(",")
+    if url.strip()
+]
+# "sync": blocking sessions in the threadpool, "async": AsyncSession
+DB_MODE = os.environ.get('DB_MODE') or "sync"
 
-engine = create_engine(
-    SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
+# Connection pool, see https://docs.sqlalchemy.org/en/14/core/pooling.html
+DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE') or 5)
+DB_MAX_OVERFLOW = int(os.environ.get('DB_MAX_OVERFLOW') or 10)
+DB_POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT') or 30)
+DB_POOL_RECYCLE = int(os.environ.get('DB_POOL_RECYCLE') or 1800)
+DB_POOL_PRE_PING = (os.environ.get('DB_POOL_PRE_PING') or "true").lower() == "true"
+
+# Applied to every new SQLite connection
+SQLITE_PRAGMAS = {
+    "journal_mode": os.environ.get('SQLITE_JOURNAL_MODE') or "WAL",
+    "synchronous": os.environ.get('SQLITE_SYNCHRONOUS') or "NORMAL",
+    "busy_timeout": int(os.environ.get('SQLITE_BUSY_TIMEOUT') or 5000),  # ms
+    "cache_size": int(os.environ.get('SQLITE_CACHE_SIZE') or -64000),  # KiB
+    "mmap_size": int(os.environ.get('SQLITE_MMAP_SIZE') or 256 * 1024 * 1024),
+}
+
+ASYNC_DRIVERS = {
+    "sqlite": "sqlite+aiosqlite",
+    "postgresql": "postgresql+asyncpg",
+    "mysql": "mysql+aiomysql",
+}
+
+
+def get_async_url(url: str) -> str:
+    """Same database as url, through the asyncio driver of its dialect"""
+    url = make_url(url)
+    return str(url.set(drivername=ASYNC_DRIVERS[url.get_backend_name()]))
+
+
+class PoolStats:
+    """How long requests wait for a pooled connection, and how often they give up"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+
+    def observe(self, wait: float, timed_out: bool = False):
+        with self._lock:
+            self.checkouts += 1
+            self.timeouts += timed_out
+            self.wait_seconds_total += wait
+            self.wait_seconds_max = max(self.wait_seconds_max, wait)
+
+
+pool_stats = PoolStats()
+
+
+class _TimedPoolMixin:
+    def _do_get(self):
+        start = time.perf_counter()
+        timed_out = True
+        try:
+            connection = super()._do_get()
+            timed_out = False
+            return connection
+        finally:
+            pool_stats.observe(time.perf_counter() - start, timed_out)
+
+
+class TimedQueuePool(_TimedPoolMixin, QueuePool):
+    pass
+
+
+class TimedAsyncQueuePool(_TimedPoolMixin, AsyncAdaptedQueuePool):
+    pass
+
+
+def is_sqlite(url: str) -> bool:
+    return make_url(url).get_backend_name() == "sqlite"
+
+
+def is_sqlite_memory(url: str) -> bool:
+    return is_sqlite(url) and make_url(url).database in (None, "", ":memory:")
+
+
+def engine_options(url: str, pool_class) -> dict:
+    if is_sqlite_memory(url):
+        return {"connect_args": {"check_same_thread": False}}
+    options = {
+        "poolclass": pool_class,
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT,
+        "pool_recycle": DB_POOL_RECYCLE,
+    }
+    if is_sqlite(url):
+        options["connect_args"] = {"check_same_thread": False}
+    else:
+        options["pool_pre_ping"] = DB_POOL_PRE_PING
+    return options
+
+
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    for name, value in SQLITE_PRAGMAS.items():
+        cursor.execute(f"PRAGMA {name}={value}")
+    cursor.close()
+
+
+def set_sqlite_replica_pragmas(dbapi_connection, connection_record):
+    set_sqlite_pragmas(dbapi_connection, connection_record)
+    # A file copy would take writes silently and drift from the primary
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA query_only=ON")
+    cursor.close()
+
+
+def _create_engine(url: str, read_only: bool = False):
+    engine = create_engine(url, **engine_options(url, TimedQueuePool))
+    if is_sqlite(url):
+        pragmas = set_sqlite_replica_pragmas if read_only else set_sqlite_pragmas
+        event.listen(engine, "connect", pragmas)
+    return engine
+
+
+def _create_async_engine(url: str, read_only: bool = False):
+    engine = create_async_engine(url, **engine_options(url, TimedAsyncQueuePool))
+    if is_sqlite(url):
+        pragmas = set_sqlite_replica_pragmas if read_only else set_sqlite_pragmas
+        event.listen(engine.sync_engine, "connect", pragmas)
+    return engine
+
+
+def _sessionmaker(engine):
+    return sessionmaker(
+        autocommit=False, autoflush=False, expire_on_commit=False, bind=engine
+    )
+
+
+def _async_sessionmaker(engine):
+    return sessionmaker(
+        autocommit=False,
+        autoflush=False,
+        expire_on_commit=False,
+        bind=engine,
+        class_=AsyncSession,
+    )
+
+
+engine = _create_engine(SQLALCHEMY_DATABASE_URL)
+SessionLocal = _sessionmaker(engine)
+replica_engines = [
+    _create_engine(url, read_only=True) for url in DATABASE_REPLICA_URLS
+]
+_read_sessions = itertools.cycle(
+    [_sessionmaker(replica) for replica in replica_engines] or [SessionLocal]
 )
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+_read_engines = itertools.cycle(replica_engines or [engine])
+
+async_engine = None
+AsyncSessionLocal = None
+async_replica_engines = []
+_async_read_sessions = None
+if DB_MODE == "async":
+    ASYNC_DATABASE_URL = os.environ.get('ASYNC_DATABASE_URL') or get_async_url(
+        SQLALCHEMY_DATABASE_URL
+    )
+    async_engine = _create_async_engine(ASYNC_DATABASE_URL)
+    AsyncSessionLocal = _async_sessionmaker(async_engine)
+    async_replica_engines = [
+        _create_async_engine(get_async_url(url), read_only=True)
+        for url in DATABASE_REPLICA_URLS
+    ]
+    _async_read_sessions = itertools.cycle(
+        [_async_sessionmaker(replica) for replica in async_replica_engines]
+        or [AsyncSessionLocal]
+    )
+
+
+def ReadSessionLocal():
+    """Session on the next replica in turn, on the primary without replicas"""
+    return next(_read_sessions)()
+
+
+def AsyncReadSessionLocal():
+    return next(_async_read_sessions)()
+
+
+def read_engine():
+    """Next replica engine in turn, the primary one without replicas"""
+    return next(_read_engines)
+
+
+def sync_engines() -> list:
+    """Every engine, the sync engines of the async ones, for event listeners"""
+    engines = [engine, *replica_engines]
+    if async_engine is not None:
+        engines.append(async_engine.sync_engine)
+    engines.extend(replica.sync_engine for replica in async_replica_engines)
+    return engines
+
+
+def get_pool_stats() -> dict:
+    """Usage of the pool of the engine serving requests, and checkout waits"""
+    pool = (async_engine.sync_engine if DB_MODE == "async" else engine).pool
+    stats = {
+        "checkouts": pool_stats.checkouts,
+        "timeouts": pool_stats.timeouts,
+        "wait_seconds_total": pool_stats.wait_seconds_total,
+        "wait_seconds_max": pool_stats.wait_seconds_max,
+        "size": 0,
+        "checked_out": 0,
+        "overflow": 0,
+        "capacity": 0,
+        "saturation": 0.0,
+    }
+    if isinstance(pool, QueuePool):
+        capacity = pool.size() + DB_MAX_OVERFLOW
+        stats.update(
+            size=pool.size(),
+            checked_out=pool.checkedout(),
+            overflow=max(pool.overflow(), 0),
+            capacity=capacity,
+            saturation=pool.checkedout() / capacity if capacity else 0.0,
+        )
+    return stats
+
 
 Base = declarative_base()
@@ -1,40 +1,92 @@
-from sqlalchemy.orm import Session
-from .database import SessionLocal
-from . import crud, schemas
-from fastapi import HTTPException, status, Depends
+from contextlib import asynccontextmanager
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy.ext.asyncio import AsyncSession
+from .database import DB_MODE, SessionLocal, AsyncSessionLocal
+from .database import ReadSessionLocal, AsyncReadSessionLocal
+from . import crud, replicas, schemas, token_cache
+from fastapi import HTTPException, Request, status, Depends
 
-from .security import oauth2_scheme, verify_jwt_token, verify_password
+from .security import oauth2_scheme, verify_jwt_token, verify_password_async
 from fastapi.security import OAuth2PasswordRequestForm
 
 
-def get_db():
-    db = SessionLocal()
+class Database:
+    """
+    Session of the current request.
+    crud functions are plain sync code: run() executes them in the threadpool
+    with a Session, or on the event loop through AsyncSession.run_sync.
+    Whatever they return must be fully loaded, since the response is
+    serialized outside of run().
+    """
+
+    def __init__(self, session):
+        self.session = session
+
+    async def run(self, func, *args, **kwargs):
+        if isinstance(self.session, AsyncSession):
+            return await self.session.run_sync(func, *args, **kwargs)
+        return await run_in_threadpool(func, self.session, *args, **kwargs)
+
+    async def release(self):
+        """End the transaction and return its connection to the pool"""
+        if isinstance(self.session, AsyncSession):
+            await self.session.close()
+        else:
+            await run_in_threadpool(self.session.close)
+
+
+@asynccontextmanager
+async def _open_db(session_factory, async_session_factory):
+    if DB_MODE == "async":
+        async with async_session_factory() as session:
+            yield Database(session)
+        return
+    db = session_factory()
     try:
-        yield db
+        yield Database(db)
     finally:
-        db.close()
+        await run_in_threadpool(db.close)
+
+
+async def get_db():
+    """Session on the primary database, for writes"""
+    async with _open_db(SessionLocal, AsyncSessionLocal) as db:
+        yield db
+
+
+async def get_read_db(request: Request):
+    """
+    Session of read-only routes: on a replica, or on the primary for clients
+    that just wrote, see replicas.py
+    """
+    if replicas.reads_primary(request):
+        factories = SessionLocal, AsyncSessionLocal
+    else:
+        factories = ReadSessionLocal, AsyncReadSessionLocal
+    async with _open_db(*factories) as db:
+        yield db
 
 
-def authenticate_user(
+async def authenticate_user(
     credentials: schemas.UserCredentials,
-    db: Session = Depends(get_db),
+    db: Database = Depends(get_db),
 ):
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Incorrect username or password",
         headers={"WWW-Authenticate": "Bearer"},
     )
-    user = crud.get_user_by_username(db, credentials.username)
+    user = await db.run(crud.get_user_by_username, credentials.username)
     if not user:
         raise credentials_exception
-    if not verify_password(credentials.password, user.hashed_password):
+    if not await verify_password_async(credentials.password, user.hashed_password):
         raise credentials_exception
     return user
 
 
-def authenticate_user_from_OAuth2(
+async def authenticate_user_from_OAuth2(
     form_data: OAuth2PasswordRequestForm = Depends(),
-    db: Session = Depends(get_db),
+    db: Database = Depends(get_db),
 ):
     credentials = schemas.UserCredentials(
         username=form_data.username, password=form_data.password
@@ -44,39 +96,57 @@ def authenticate_user_from_OAuth2(
         detail="Incorrect username or password",
         headers={"WWW-Authenticate": "Bearer"},
     )
-    user = crud.get_user_by_username(db, credentials.username)
+    user = await db.run(crud.get_user_by_username, credentials.username)
     if not user:
         raise credentials_exception
-    if not verify_password(credentials.password, user.hashed_password):
+    if not await verify_password_async(credentials.password, user.hashed_password):
         raise credentials_exception
     return user
 
 
-def get_current_user(
-    db: Session = Depends(get_db), token: str = Depends(oauth2_scheme)
-):
+async def get_current_user(
+    db: Database = Depends(get_db), token: str = Depends(oauth2_scheme)
+) -> schemas.CurrentUser:
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
-    username = verify_jwt_token(token)
-    if username is None:
+    token_data = verify_jwt_token(token)
+    if token_data is None:
         raise credentials_exception
-    user = crud.get_user_by_username(db, username=username)
-    if user is None:
+    if token_data.user_id is not None:
+        cached_user = token_cache.get_user(token_data.user_id, token)
+        if cached_user is not None:
+            return cached_user
+        user = await db.run(crud.get_user_by_id, user_id=token_data.user_id)
+    else:  # Issued before tokens carried the user id
+        user = await db.run(crud.get_user_by_username, username=token_data.username)
+    if user is None or user.username != token_data.username:
         raise credentials_exception
-    return user
+    return token_cache.set_user(token, user)
 
 
-def get_post_by_id(
-    post_id: int,
-    db: Session = Depends(get_db),
-):
-    post = crud.get_post_by_id(db=db, post_id=post_id)
+async def _get_post_or_404(db: Database, post_id: int):
+    post = await db.run(crud.get_post_by_id, post_id=post_id)
     if post is None:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Post not found",
         )
     return post
+
+
+async def get_post_by_id(
+    post_id: int,
+    db: Database = Depends(get_db),
+):
+    return await _get_post_or_404(db, post_id)
+
+
+async def read_post_by_id(
+    post_id: int,
+    db: Database = Depends(get_read_db),
+):
+    """get_post_by_id for read-only routes"""
+    return await _get_post_or_404(db, post_id)
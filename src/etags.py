@@ -0,0 +1,83 @@
+"""
+Conditional GET.
+
+ETags are weak and computed from what a response is built of: ids, authors,
+contents and revisions of posts (crud bumps Post.revision with every change
+of a serialized field), pending write-behind reactions and usernames. SQLite
+gives the id of a deleted newest post to the next one, whose revision starts
+over: its author and content tell it apart. A request
+whose If-None-Match matches is answered 304 before the body is serialized.
+"""
+import hashlib
+import os
+
+from fastapi import Request, Response
+
+from . import reaction_buffer
+
+# Cache-Control of each conditional route. "no-cache" lets clients keep
+# responses but makes them revalidate with If-None-Match every time.
+CACHE_CONTROL = {
+    "feed": os.environ.get("CACHE_CONTROL_FEED") or "no-cache",
+    "post": os.environ.get("CACHE_CONTROL_POST") or "no-cache",
+    "user": os.environ.get("CACHE_CONTROL_USER") or "no-cache",
+}
+
+not_modified_response = {
+    304: {"description": "Not modified since the ETag given in If-None-Match"},
+}
+
+
+def _etag(version) -> str:
+    digest = hashlib.blake2b(repr(version).encode(), digest_size=8).hexdigest()
+    return f'W/"{digest}"'
+
+
+def _post_version(post) -> tuple:
+    # Write-behind reactions show in the counters before they bump revision
+    return (
+        post.id,
+        post.revision,
+        post.author_id,
+        post.content,
+        reaction_buffer.buffer.pending_counts(post.id),
+    )
+
+
+def post_etag(post) -> str:
+    return _etag(_post_version(post))
+
+
+def posts_etag(posts) -> str:
+    return _etag([_post_version(post) for post in posts])
+
+
+def user_etag(user, posts) -> str:
+    """user is serialized with posts as its recent posts"""
+    return _etag((user.id, user.username, [_post_version(post) for post in posts]))
+
+
+def matches(if_none_match: str, etag: str) -> bool:
+    if if_none_match.strip() == "*":
+        return True
+    # Weak comparison: W/ prefixes are ignored
+    tags = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+    return etag.removeprefix("W/") in tags
+
+
+def is_fresh(request: Request, etag: str) -> bool:
+    """Whether the client already has the response tagged etag"""
+    header = request.headers.get("if-none-match")
+    return header is not None and matches(header, etag)
+
+
+def _headers(etag: str, route: str) -> dict:
+    return {"ETag": etag, "Cache-Control": CACHE_CONTROL[route]}
+
+
+def set_headers(response: Response, etag: str, route: str):
+    response.headers.update(_headers(etag, route))
+
+
+def not_modified(etag: str, route: str) -> Response:
+    return Response(status_code=304, headers=_headers(etag, route))
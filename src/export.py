@@ -0,0 +1,82 @@
+"""
+Streaming export of whole tables as NDJSON, one JSON object per line.
+
+Rows are read in id order by a single query on a connection of its own, of
+a replica for the API and of the primary for the CLI, with stream_results:
+drivers with server-side cursors fetch them EXPORT_CHUNK_SIZE at a time, and
+SQLite steps its cursor as rows are read, so memory stays flat at any table
+size. An interrupted export resumes with the id of the last line received
+as `after`. Posts are in the format of schemas.Post, users without their
+posts and password hashes.
+"""
+import os
+import zlib
+from typing import Iterator
+
+import orjson
+from sqlalchemy import select
+
+from . import models, serializers
+
+EXPORT_CHUNK_SIZE = int(os.environ.get("EXPORT_CHUNK_SIZE") or 1000)
+
+
+def _user(row) -> dict:
+    return {"username": row.username, "id": row.id}
+
+
+def _reaction(row) -> dict:
+    return {
+        "id": row.id,
+        "from_id": row.from_id,
+        "post_id": row.post_id,
+        "is_like": row.is_like,
+    }
+
+
+# Exported columns of each table, the id first, and the dict of a row
+TABLES = {
+    "posts": (
+        (
+            models.Post.id,
+            models.Post.content,
+            models.Post.author_id,
+            models.Post.likes_count,
+            models.Post.dislikes_count,
+        ),
+        serializers.post,
+    ),
+    "users": ((models.User.id, models.User.username), _user),
+    "reactions": (
+        (
+            models.Reaction.id,
+            models.Reaction.from_id,
+            models.Reaction.post_id,
+            models.Reaction.is_like,
+        ),
+        _reaction,
+    ),
+}
+
+
+def ndjson(engine, table: str, after: int | None = None) -> Iterator[bytes]:
+    """Lines of the rows of table with an id above after, a chunk at a time"""
+    columns, serialize = TABLES[table]
+    query = select(*columns).order_by(columns[0])
+    if after is not None:
+        query = query.where(columns[0] > after)
+    with engine.connect() as connection:
+        result = connection.execution_options(stream_results=True).execute(query)
+        for rows in result.partitions(EXPORT_CHUNK_SIZE):
+            yield b"".join(
+                orjson.dumps(serialize(row), option=orjson.OPT_APPEND_NEWLINE)
+                for row in rows
+            )
+
+
+def gzipped(chunks: Iterator[bytes]) -> Iterator[bytes]:
+    """Compress chunks on the fly, flushing each so that it can be read at once"""
+    compressor = zlib.compressobj(5, wbits=zlib.MAX_WBITS | 16)  # gzip format
+    for chunk in chunks:
+        yield compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+    yield compressor.flush()
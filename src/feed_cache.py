@@ -0,0 +1,367 @@
+"""
+Cache of serialized anonymous GET /posts/ responses.
+
+FeedCacheMiddleware answers requests without an Authorization header from
+memory, before routing, so a cached page costs no session and no query.
+Pages are keyed by their pagination parameters and kept with the ids of
+the posts they hold, which crud decorators use to drop exactly the pages a
+write changes, once it is committed:
+
+- a new post shifts offset pages and may enter 'before' pages,
+- an edit or reaction on post X changes the pages holding X,
+- deleting post X changes the pages holding X and shifts the offset pages
+  that end below X.
+
+Only one request at a time builds a missing page, the others wait for it.
+The cache is per process: FEED_CACHE_TTL bounds how long a page can stay
+stale in a worker that did not handle the write. Pages may also be rebuilt
+from a lagging replica, so clients holding the read_primary cookie of
+replicas.StickyPrimaryMiddleware bypass the cache and read their writes.
+"""
+import asyncio
+import gzip
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import parse_qsl
+
+from . import etags, replicas, schemas
+
+FEED_CACHE_ENABLED = (
+    os.environ.get("FEED_CACHE_ENABLED") or "false"
+).lower() == "true"
+FEED_CACHE_SIZE = int(os.environ.get("FEED_CACHE_SIZE") or 256)  # pages
+FEED_CACHE_TTL = float(os.environ.get("FEED_CACHE_TTL") or 5)
+# Also keep a gzip copy of every page, for clients accepting it
+FEED_CACHE_GZIP = (os.environ.get("FEED_CACHE_GZIP") or "true").lower() == "true"
+
+FEED_PATH = "/posts/"
+
+_PAGINATION_FIELDS = ("skip", "limit", "after", "before")
+
+
+class Page:
+    def __init__(self, kind: str, post_ids: list[int], headers: list, body: bytes):
+        self.kind = kind  # "offset", "after" or "before"
+        self.post_ids = set(post_ids)
+        self.lowest_id = min(post_ids, default=None)
+        self.headers = headers
+        self.body = body
+        self.gzip_body = gzip.compress(body, 5) if FEED_CACHE_GZIP else None
+        self.etag = dict(headers).get(b"etag", b"").decode()
+        self.expires_at = time.monotonic() + FEED_CACHE_TTL
+
+    def shifted_by_new_post(self) -> bool:
+        return self.kind != "after"
+
+    def changed_by(self, post_id: int, deleted: bool = False) -> bool:
+        if post_id in self.post_ids:
+            return True
+        return (
+            deleted
+            and self.kind == "offset"
+            and self.lowest_id is not None
+            and self.lowest_id < post_id
+        )
+
+
+class _Build:
+    """A page being built by a request, and the writes committed meanwhile"""
+
+    def __init__(self):
+        self.done = asyncio.get_running_loop().create_future()
+        self.new_post = False
+        self.changed = set()
+        self.deleted = set()
+        self.cleared = False
+
+    def invalidates(self, page: Page) -> bool:
+        return (
+            self.cleared
+            or (self.new_post and page.shifted_by_new_post())
+            or any(page.changed_by(post_id) for post_id in self.changed)
+            or any(page.changed_by(post_id, deleted=True) for post_id in self.deleted)
+        )
+
+
+class FeedCache:
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._pages = OrderedDict()  # key -> Page
+        self._builds = {}  # key -> _Build
+        # Writes invalidate from the threadpool, requests read on the event loop
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key) -> Page | None:
+        with self._lock:
+            page = self._pages.get(key)
+            if page is None or page.expires_at < time.monotonic():
+                self.misses += 1
+                return None
+            self._pages.move_to_end(key)
+            self.hits += 1
+            return page
+
+    def start_build(self, key) -> _Build | None:
+        """None if another request already builds the page"""
+        with self._lock:
+            if key in self._builds:
+                return None
+            build = self._builds[key] = _Build()
+            return build
+
+    def waiting_build(self, key) -> _Build | None:
+        with self._lock:
+            return self._builds.get(key)
+
+    def finish_build(self, key, build: _Build, page: Page | None):
+        with self._lock:
+            del self._builds[key]
+            if page is not None and not build.invalidates(page):
+                self._pages[key] = page
+                self._pages.move_to_end(key)
+                while len(self._pages) > self.max_size:
+                    self._pages.popitem(last=False)
+                    self.evictions += 1
+        build.done.set_result(None)
+
+    def _invalidate(self, predicate, mark_build):
+        with self._lock:
+            for key in [key for key, page in self._pages.items() if predicate(page)]:
+                del self._pages[key]
+            for build in self._builds.values():
+                mark_build(build)
+
+    def new_post(self):
+        self._invalidate(
+            Page.shifted_by_new_post,
+            lambda build: setattr(build, "new_post", True),
+        )
+
+    def changed(self, post_id: int):
+        self._invalidate(
+            lambda page: page.changed_by(post_id),
+            lambda build: build.changed.add(post_id),
+        )
+
+    def deleted(self, post_id: int):
+        self._invalidate(
+            lambda page: page.changed_by(post_id, deleted=True),
+            lambda build: build.deleted.add(post_id),
+        )
+
+    def clear(self):
+        self._invalidate(
+            lambda page: True, lambda build: setattr(build, "cleared", True)
+        )
+
+    def __len__(self):
+        return len(self._pages)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+        }
+
+
+feed_cache = FeedCache(FEED_CACHE_SIZE)
+
+
+def invalidate_new_post(func):
+    def wrapper(*args, **kwargs):
+        post_obj = func(*args, **kwargs)
+        if FEED_CACHE_ENABLED:
+            feed_cache.new_post()
+        return post_obj
+    return wrapper
+
+
+def invalidate_post(func):
+    """Drop the pages holding the post edited by the wrapped function"""
+    def wrapper(db_obj, content, post_obj):
+        post_obj = func(db_obj, content, post_obj)
+        if FEED_CACHE_ENABLED:
+            feed_cache.changed(post_obj.id)
+        return post_obj
+    return wrapper
+
+
+def invalidate_deleted_post(func):
+    def wrapper(db_obj, post_obj):
+        post_id = post_obj.id
+        result = func(db_obj, post_obj)
+        if FEED_CACHE_ENABLED:
+            feed_cache.deleted(post_id)
+        return result
+    return wrapper
+
+
+def invalidate_reacted_post(func):
+    """
+    Drop the pages holding the post whose reactions the wrapped function
+    changed, which returns the added or deleted reaction, or None
+    """
+    def wrapper(db_obj, *args):
+        reaction_obj = func(db_obj, *args)
+        if FEED_CACHE_ENABLED and reaction_obj is not None:
+            feed_cache.changed(reaction_obj.post_id)
+        return reaction_obj
+    return wrapper
+
+
+def invalidate_batch_reactions(func):
+    def wrapper(*args, **kwargs):
+        results = func(*args, **kwargs)
+        if FEED_CACHE_ENABLED:
+            for post_id in {result.post_id for result in results if result.changed}:
+                feed_cache.changed(post_id)
+        return results
+    return wrapper
+
+
+def invalidate_buffered_reaction(func):
+    def wrapper(db_obj, is_like, post_obj, user_obj):
+        changed = func(db_obj, is_like, post_obj, user_obj)
+        if FEED_CACHE_ENABLED and changed:
+            feed_cache.changed(post_obj.id)
+        return changed
+    return wrapper
+
+
+def invalidate_all(func):
+    def wrapper(*args, **kwargs):
+        result = func(*args, **kwargs)
+        if FEED_CACHE_ENABLED:
+            feed_cache.clear()
+        return result
+    return wrapper
+
+
+def _page_key(query_string: bytes):
+    """Pagination parameters of a request with the defaults filled in"""
+    params = dict(parse_qsl(query_string.decode("latin-1")))
+    key = []
+    for name in _PAGINATION_FIELDS:
+        value = params.get(name)
+        if value is None:
+            value = schemas.PaginationParams.__fields__[name].default
+        key.append(None if value is None else str(value))
+    return tuple(key)
+
+
+def _page_kind(key) -> str:
+    skip, limit, after, before = key
+    if after is not None:
+        return "after"
+    if before is not None:
+        return "before"
+    return "offset"
+
+
+def _header(scope, name: bytes) -> bytes | None:
+    for key, value in scope["headers"]:
+        if key == name:
+            return value
+    return None
+
+
+class FeedCacheMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if (
+            scope["type"] != "http"
+            or scope["method"] != "GET"
+            or scope["path"] != FEED_PATH
+            or _header(scope, b"authorization") is not None
+            or replicas.has_sticky_cookie(scope)
+        ):
+            return await self.app(scope, receive, send)
+
+        key = _page_key(scope["query_string"])
+        page = feed_cache.get(key)
+        if page is None:
+            build = feed_cache.waiting_build(key)
+            if build is not None:
+                await asyncio.shield(build.done)
+                page = feed_cache.get(key)
+        if page is not None:
+            return await self._send_page(scope, send, page)
+
+        build = feed_cache.start_build(key)
+        if build is None:  # Lost the race to another request
+            return await self.app(scope, receive, send)
+        page = None
+        try:
+            page = await self._build(scope, receive, send, key)
+        finally:
+            feed_cache.finish_build(key, build, page)
+
+    async def _build(self, scope, receive, send, key) -> Page | None:
+        """Answer the request with the app, and return the page to cache"""
+        start = {}
+        chunks = []
+
+        async def capture(message):
+            if message["type"] == "http.response.start":
+                start.update(message)
+            elif message["type"] == "http.response.body":
+                chunks.append(message.get("body", b""))
+            await send(message)
+
+        await self.app(scope, receive, capture)
+        if start.get("status") != 200:
+            return None
+        body = b"".join(chunks)
+        post_ids = [post["id"] for post in json.loads(body)]
+        return Page(_page_kind(key), post_ids, start.get("headers", []), body)
+
+    async def _send_page(self, scope, send, page: Page):
+        if_none_match = _header(scope, b"if-none-match")
+        if (
+            page.etag
+            and if_none_match is not None
+            and etags.matches(if_none_match.decode("latin-1"), page.etag)
+        ):
+            headers = [
+                (name, value)
+                for name, value in page.headers
+                if name in (b"etag", b"cache-control")
+            ]
+            await send(
+                {"type": "http.response.start", "status": 304, "headers": headers}
+            )
+            await send({"type": "http.response.body", "body": b""})
+            return
+
+        body = page.body
+        headers = [
+            (name, value) for name, value in page.headers if name != b"content-length"
+        ]
+        accept_encoding = _header(scope, b"accept-encoding") or b""
+        if page.gzip_body is not None:
+            headers.append((b"vary", b"accept-encoding"))
+            if b"gzip" in accept_encoding:
+                body = page.gzip_body
+                headers.append((b"content-encoding", b"gzip"))
+        headers.append((b"content-length", str(len(body)).encode()))
+        await send(
+            {"type": "http.response.start", "status": 200, "headers": headers}
+        )
+        await send({"type": "http.response.body", "body": body})
+
+
+def stats() -> dict:
+    return feed_cache.stats()
@@ -1,10 +1,15 @@
 from fastapi import FastAPI
+from fastapi.responses import PlainTextResponse
+from . import database
 from .database import engine
-from . import models, schemas
+from . import feed_cache, metrics, migrations, profiler, reaction_cache, schemas
+from . import reaction_buffer, replicas, search, security, token_cache
 
-from .routes import account, users, posts
+from .routes import account, export, users, posts, stats
 
-models.Base.metadata.create_all(bind=engine)
+# The schema is created and upgraded by `python -m src.manage migrate`
+migrations.check(engine)
+search.enable(engine)
 
 tags_metadata = [
     {
@@ -23,6 +28,14 @@ tags_metadata = [
         "name": "reactions",
         "description": "Like and dislike other people's posts"
     },
+    {
+        "name": "export",
+        "description": "Stream whole tables as NDJSON",
+    },
+    {
+        "name": "stats",
+        "description": "Service statistics",
+    },
 ]
 
 app = FastAPI(
@@ -35,8 +48,74 @@ app = FastAPI(
     },
 )
 
+
+@app.on_event("startup")
+def clear_caches():
+    # The database may have changed since a shared cache was filled
+    reaction_cache.reaction_cache.clear()
+    token_cache.token_cache.clear()
+
+
+@app.on_event("startup")
+def start_hash_pool():
+    security.start_hash_pool()
+
+
+@app.on_event("shutdown")
+def shutdown_hash_pool():
+    security.shutdown_hash_pool()
+
+
+if reaction_buffer.REACTION_WRITE_BEHIND:
+
+    @app.on_event("startup")
+    async def start_reaction_flush():
+        reaction_buffer.start()
+
+    @app.on_event("shutdown")
+    async def flush_reactions():
+        await reaction_buffer.stop()
+
+
+if feed_cache.FEED_CACHE_ENABLED:
+    app.add_middleware(feed_cache.FeedCacheMiddleware)
+
+
+if database.replica_engines:
+    app.add_middleware(replicas.StickyPrimaryMiddleware)
+
+
+if metrics.METRICS_ENABLED:
+    for instrumented in database.sync_engines():
+        metrics.instrument_engine(instrumented)
+    metrics.register_cache_collectors(
+        {
+            "reaction": reaction_cache.stats,
+            "token": token_cache.stats,
+            "feed": feed_cache.stats,
+        }
+    )
+    metrics.register_pool_collectors(database.get_pool_stats)
+    metrics.register_reaction_buffer_collectors(reaction_buffer.stats)
+    app.add_middleware(metrics.MetricsMiddleware)
+
+    @app.get("/metrics", include_in_schema=False)
+    def get_metrics():
+        return PlainTextResponse(
+            metrics.render(), media_type="text/plain; version=0.0.4"
+        )
+
+
+if profiler.PROFILE_SQL:
+    for instrumented in database.sync_engines():
+        profiler.instrument_engine(instrumented)
+    app.add_middleware(profiler.ProfilerMiddleware)
+
+
 app.include_router(account.signup_router)
 app.include_router(account.router, prefix="/account")
 app.include_router(users.router, prefix="/users")
 app.include_router(posts.router, prefix="/posts")
 app.include_router(posts.manage_post_router, prefix="/posts")
+app.include_router(export.router, prefix="/export")
+app.include_router(stats.router, prefix="/stats")
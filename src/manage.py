@@ -0,0 +1,113 @@
+"""
+Maintenance commands.
+
+    python -m src.manage migrate
+    python -m src.manage reconcile-counters
+    python -m src.manage rebuild-search
+    python -m src.manage export posts|users|reactions [--after ID] [--gzip]
+    python -m src.manage sync-replicas
+"""
+import argparse
+import sqlite3
+import sys
+from contextlib import closing
+
+from sqlalchemy.engine import make_url
+
+from . import cache, crud, database, export, migrations, reaction_cache, search
+from . import token_cache
+from .database import SessionLocal, engine
+
+
+def migrate(args):
+    """Create the tables, or upgrade them to the schema of this version"""
+    applied = migrations.migrate(engine)
+    # Migrations may change rows held by the shared caches
+    for shared_path in (reaction_cache.shared_path(), token_cache.shared_path()):
+        cache.clear_file(shared_path)
+    print(f"Applied {applied} migrations, schema at version {migrations.LATEST}")
+
+
+def reconcile_counters(args):
+    """Recompute likes_count and dislikes_count of every post"""
+    migrations.check(engine)
+    with SessionLocal() as db:
+        updated = crud.reconcile_reactions_counts(db)
+    print(f"Reconciled reaction counters of {updated} posts")
+
+
+def rebuild_search(args):
+    """Index the content of every post for full-text search again"""
+    migrations.check(engine)
+    with engine.begin() as connection:
+        if not search.create_index(connection):
+            print("Full-text search needs SQLite with FTS5, searches use LIKE")
+            return
+        indexed = search.rebuild(connection)
+    print(f"Indexed {indexed} posts for search")
+
+
+def export_table(args):
+    """Write every row of a table as NDJSON, to stdout or a file"""
+    migrations.check(engine)
+    chunks = export.ndjson(engine, args.table, args.after)
+    if args.gzip:
+        chunks = export.gzipped(chunks)
+    output = sys.stdout.buffer if args.output == "-" else open(args.output, "wb")
+    with output:
+        for chunk in chunks:
+            output.write(chunk)
+
+
+def sync_replicas(args):
+    """Copy a SQLite database to its SQLite replicas, to try replicas locally"""
+    if not database.is_sqlite(database.SQLALCHEMY_DATABASE_URL):
+        print("Only a SQLite DATABASE_URL can be copied to replicas")
+        return
+    migrations.check(engine)
+    source_path = make_url(database.SQLALCHEMY_DATABASE_URL).database
+    for url in database.DATABASE_REPLICA_URLS:
+        if database.is_sqlite_memory(url) or not database.is_sqlite(url):
+            print(f"Skipped {url}: not a SQLite file")
+            continue
+        # The backup API copies a consistent snapshot, also while the app writes
+        with closing(sqlite3.connect(source_path)) as source, closing(
+            sqlite3.connect(make_url(url).database)
+        ) as replica:
+            source.backup(replica)
+        print(f"Copied the database to {url}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m src.manage")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    migrate_parser = commands.add_parser("migrate", help=migrate.__doc__)
+    migrate_parser.set_defaults(handler=migrate)
+
+    reconcile = commands.add_parser(
+        "reconcile-counters", help=reconcile_counters.__doc__
+    )
+    reconcile.set_defaults(handler=reconcile_counters)
+
+    rebuild = commands.add_parser("rebuild-search", help=rebuild_search.__doc__)
+    rebuild.set_defaults(handler=rebuild_search)
+
+    export_parser = commands.add_parser("export", help=export_table.__doc__)
+    export_parser.add_argument("table", choices=list(export.TABLES))
+    export_parser.add_argument(
+        "--after", type=int, help="Id of the last row already exported, to resume"
+    )
+    export_parser.add_argument("--output", "-o", default="-", help="File, - for stdout")
+    export_parser.add_argument("--gzip", action="store_true")
+    export_parser.set_defaults(handler=export_table)
+
+    sync = commands.add_parser("sync-replicas", help=sync_replicas.__doc__)
+    sync.set_defaults(handler=sync_replicas)
+
+    args = parser.parse_args(argv)
+    args.handler(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,287 @@
+"""
+Prometheus metrics.
+
+Samples are aggregated per thread without locks: every thread writes to its
+own shard, and shards are only merged when /metrics is scraped. Values
+reported by other modules (caches, connection pool) are read at scrape time.
+"""
+import contextvars
+import os
+import threading
+import time
+from bisect import bisect_left
+
+from sqlalchemy import event
+
+METRICS_ENABLED = (os.environ.get("METRICS_ENABLED") or "false").lower() == "true"
+
+LATENCY_BUCKETS = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0
+)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+HISTOGRAMS = {
+    "http_request_duration_seconds": (
+        "Time to answer a request, by route",
+        LATENCY_BUCKETS,
+    ),
+    "db_queries_per_request": (
+        "SQL statements executed by a request, by route",
+        COUNT_BUCKETS,
+    ),
+    "db_time_per_request_seconds": (
+        "Time spent executing SQL statements by a request, by route",
+        LATENCY_BUCKETS,
+    ),
+    "password_hash_duration_seconds": (
+        "Time to hash or verify a password, including the queue",
+        LATENCY_BUCKETS,
+    ),
+    "reaction_flush_duration_seconds": (
+        "Time to commit a batch of write-behind reactions",
+        LATENCY_BUCKETS,
+    ),
+}
+COUNTERS = {
+    "http_requests_total": "Answered requests, by route, method and status",
+    "db_queries_total": "Executed SQL statements",
+    "db_query_seconds_total": "Time spent executing SQL statements",
+}
+
+
+class _Shard:
+    def __init__(self):
+        self.counters = {}  # (name, labels) -> value
+        self.histograms = {}  # (name, labels) -> [bucket counts..., sum, count]
+
+
+_shards = []
+_shards_lock = threading.Lock()
+_local = threading.local()
+
+
+def _shard() -> _Shard:
+    shard = getattr(_local, "shard", None)
+    if shard is None:
+        shard = _local.shard = _Shard()
+        with _shards_lock:
+            _shards.append(shard)
+    return shard
+
+
+def inc(name: str, labels: tuple = (), value: float = 1):
+    counters = _shard().counters
+    key = (name, labels)
+    counters[key] = counters.get(key, 0) + value
+
+
+def observe(name: str, value: float, labels: tuple = ()):
+    histograms = _shard().histograms
+    key = (name, labels)
+    buckets = HISTOGRAMS[name][1]
+    histogram = histograms.get(key)
+    if histogram is None:
+        histogram = histograms[key] = [0] * (len(buckets) + 3)
+    # Non-cumulative here, made cumulative when rendered
+    histogram[bisect_left(buckets, value)] += 1
+    histogram[-2] += value
+    histogram[-1] += 1
+
+
+# Read at scrape time: name -> (help, type, callable returning {labels: value}),
+# labels being a tuple of (name, value) pairs
+_collectors = {}
+
+
+def register_collector(name: str, help_text: str, kind: str, collect):
+    _collectors[name] = (help_text, kind, collect)
+
+
+def _format_labels(label_names: tuple, labels: tuple, extra: str = "") -> str:
+    pairs = [f'{key}="{value}"' for key, value in zip(label_names, labels)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+LABEL_NAMES = {
+    "http_requests_total": ("route", "method", "status"),
+    "http_request_duration_seconds": ("route",),
+    "db_queries_per_request": ("route",),
+    "db_time_per_request_seconds": ("route",),
+    "password_hash_duration_seconds": ("operation",),
+}
+
+
+def render() -> str:
+    with _shards_lock:
+        shards = list(_shards)
+    counters = {}
+    histograms = {}
+    # Shards keep being written while they are read, copy them first
+    for shard in shards:
+        for key, value in list(shard.counters.items()):
+            counters[key] = counters.get(key, 0) + value
+        for key, values in list(shard.histograms.items()):
+            merged = histograms.setdefault(key, [0] * len(values))
+            for index, value in enumerate(list(values)):
+                merged[index] += value
+
+    lines = []
+    for name, help_text in COUNTERS.items():
+        lines += [f"# HELP {name} {help_text}", f"# TYPE {name} counter"]
+        for (metric, labels), value in sorted(counters.items()):
+            if metric == name:
+                label_names = LABEL_NAMES.get(name, ())
+                lines.append(f"{name}{_format_labels(label_names, labels)} {value}")
+    for name, (help_text, buckets) in HISTOGRAMS.items():
+        lines += [f"# HELP {name} {help_text}", f"# TYPE {name} histogram"]
+        for (metric, labels), values in sorted(histograms.items()):
+            if metric != name:
+                continue
+            label_names = LABEL_NAMES.get(name, ())
+            cumulative = 0
+            for bound, count in zip((*buckets, "+Inf"), values):
+                cumulative += count
+                bucket_labels = _format_labels(label_names, labels, f'le="{bound}"')
+                lines.append(f"{name}_bucket{bucket_labels} {cumulative}")
+            label_text = _format_labels(label_names, labels)
+            lines.append(f"{name}_sum{label_text} {values[-2]}")
+            lines.append(f"{name}_count{label_text} {values[-1]}")
+    for name, (help_text, kind, collect) in _collectors.items():
+        lines += [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"]
+        for labels, value in collect().items():
+            label_text = ",".join(f'{key}="{label}"' for key, label in labels)
+            label_text = "{" + label_text + "}" if label_text else ""
+            lines.append(f"{name}{label_text} {value}")
+    return "\n".join(lines) + "\n"
+
+
+# [statements, seconds] of the current request
+_request_db = contextvars.ContextVar("request_db", default=None)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    context._metrics_start = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - context._metrics_start
+    inc("db_queries_total")
+    inc("db_query_seconds_total", value=elapsed)
+    request_db = _request_db.get()
+    if request_db is not None:
+        request_db[0] += 1
+        request_db[1] += elapsed
+
+
+def instrument_engine(engine):
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+
+
+def _cache_stats(caches: dict, key: str):
+    def collect():
+        return {(("cache", name),): stats()[key] for name, stats in caches.items()}
+    return collect
+
+
+def register_cache_collectors(caches: dict):
+    """caches maps a cache name to its stats() function"""
+    for name, key, kind, help_text in (
+        ("cache_entries", "size", "gauge", "Entries in a cache"),
+        ("cache_hits_total", "hits", "counter", "Lookups that found an entry"),
+        ("cache_misses_total", "misses", "counter", "Lookups that found nothing"),
+        ("cache_evictions_total", "evictions", "counter", "Evicted entries"),
+    ):
+        register_collector(name, help_text, kind, _cache_stats(caches, key))
+
+
+def register_pool_collectors(get_pool_stats):
+    def collect(key):
+        return lambda: {(): get_pool_stats()[key]}
+
+    for name, key, kind, help_text in (
+        ("db_pool_checked_out", "checked_out", "gauge", "Connections in use"),
+        ("db_pool_capacity", "capacity", "gauge", "Pool size plus overflow"),
+        ("db_pool_saturation", "saturation", "gauge", "Share of capacity in use"),
+        ("db_pool_checkouts_total", "checkouts", "counter", "Connections taken"),
+        (
+            "db_pool_timeouts_total",
+            "timeouts",
+            "counter",
+            "Requests that gave up waiting for a connection",
+        ),
+        (
+            "db_pool_wait_seconds_total",
+            "wait_seconds_total",
+            "counter",
+            "Time spent waiting for a connection",
+        ),
+    ):
+        register_collector(name, help_text, kind, collect(key))
+
+
+def register_reaction_buffer_collectors(get_stats):
+    register_collector(
+        "reaction_buffer_pending",
+        "Write-behind reactions not committed yet",
+        "gauge",
+        lambda: {(): get_stats()["pending"]},
+    )
+    register_collector(
+        "reaction_buffer_flushed_total",
+        "Write-behind reactions committed",
+        "counter",
+        lambda: {(): get_stats()["flushed"]},
+    )
+
+
+def _route_template(scope) -> str:
+    """Path template of the matched route, to keep label cardinality low"""
+    app = scope.get("app")
+    if app is None:
+        return "unmatched"
+    templates = getattr(app.state, "metrics_route_templates", None)
+    if templates is None:
+        templates = {
+            getattr(route, "endpoint", None): route.path for route in app.routes
+        }
+        app.state.metrics_route_templates = templates
+    endpoint = scope.get("endpoint")
+    if endpoint is None:
+        # Answered before routing, e.g. from the feed cache
+        path = scope["path"]
+        return path if path in templates.values() else "unmatched"
+    return templates.get(endpoint, "unmatched")
+
+
+class MetricsMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        start = time.perf_counter()
+        request_db = [0, 0.0]
+        token = _request_db.set(request_db)
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            _request_db.reset(token)
+            route = _route_template(scope)
+            inc("http_requests_total", (route, scope["method"], status))
+            observe(
+                "http_request_duration_seconds", time.perf_counter() - start, (route,)
+            )
+            observe("db_queries_per_request", request_db[0], (route,))
+            observe("db_time_per_request_seconds", request_db[1], (route,))
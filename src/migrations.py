@@ -0,0 +1,153 @@
+"""
+Schema migrations.
+
+The schema_version table holds the number of MIGRATIONS applied to the
+database. `python -m src.manage migrate` applies the missing ones in order,
+each in its own transaction with the version bump, and is meant to run once
+per deploy, before the workers start. Workers only check() the version at
+startup: they never create tables, so they can't race each other doing it.
+
+Migration 1 creates the tables of the current models, and databases from
+before schema_version start at 0. Every migration is therefore written to be
+a no-op when its change is already there, which also makes a migration
+interrupted midway (SQLite commits DDL as it goes) safe to run again.
+"""
+import hashlib
+import logging
+import uuid
+
+from sqlalchemy import (
+    Column,
+    Integer,
+    MetaData,
+    String,
+    Table,
+    inspect,
+    select,
+    text,
+)
+
+from . import crud, models, search
+
+logger = logging.getLogger(__name__)
+
+_metadata = MetaData()
+schema_version = Table(
+    "schema_version",
+    _metadata,
+    Column("version", Integer, nullable=False),
+)
+# One random id per database, written when it is migrated, for caches kept
+# outside of it to tell databases apart, even a new one at the same URL
+database_instance = Table(
+    "database_instance",
+    _metadata,
+    Column("instance_id", String, nullable=False),
+)
+
+
+class SchemaOutdated(RuntimeError):
+    pass
+
+
+def _create_tables(connection):
+    models.Base.metadata.create_all(bind=connection)
+
+
+def _add_post_counters(connection):
+    columns = {column["name"] for column in inspect(connection).get_columns("posts")}
+    missing = [
+        name
+        for name in ("likes_count", "dislikes_count", "revision")
+        if name not in columns
+    ]
+    for name in missing:
+        connection.execute(
+            text(f"ALTER TABLE posts ADD COLUMN {name} INTEGER NOT NULL DEFAULT 0")
+        )
+    if missing:
+        connection.execute(crud.reactions_counts_update())
+
+
+def _create_index(table, name):
+    def create(connection):
+        index = next(index for index in table.indexes if index.name == name)
+        index.create(bind=connection, checkfirst=True)
+
+    create.__name__ = f"_create_{name}"
+    return create
+
+
+def _create_search_index(connection):
+    search.create_index(connection)
+
+
+def _create_instance_id(connection):
+    if connection.execute(select(database_instance.c.instance_id)).first() is None:
+        connection.execute(
+            database_instance.insert().values(instance_id=uuid.uuid4().hex)
+        )
+
+
+# Append only: the version of a database is the number of these applied
+MIGRATIONS = [
+    _create_tables,
+    _add_post_counters,
+    # Posts of an author newest first
+    _create_index(models.Post.__table__, "ix_posts_author_id_id"),
+    _create_search_index,
+    # Counts per post, and the reactions deleted with a post
+    _create_index(models.Reaction.__table__, "ix_reactions_post_id_is_like"),
+    _create_instance_id,
+]
+LATEST = len(MIGRATIONS)
+
+
+def current_version(connection) -> int:
+    if not inspect(connection).has_table("schema_version"):
+        return 0
+    return connection.execute(select(schema_version.c.version)).scalar() or 0
+
+
+def _set_version(connection, version: int):
+    connection.execute(schema_version.delete())
+    connection.execute(schema_version.insert().values(version=version))
+
+
+def migrate(engine) -> int:
+    """Apply the missing migrations, returns how many were applied"""
+    with engine.begin() as connection:
+        _metadata.create_all(bind=connection)
+        version = current_version(connection)
+    for number in range(version + 1, LATEST + 1):
+        with engine.begin() as connection:
+            migration = MIGRATIONS[number - 1]
+            logger.info("Migration %d: %s", number, migration.__name__)
+            migration(connection)
+            _set_version(connection, number)
+    return max(LATEST - version, 0)
+
+
+def instance_key(engine) -> str:
+    """Short digest of the URL and the instance id of a migrated database"""
+    with engine.connect() as connection:
+        instance_id = connection.execute(
+            select(database_instance.c.instance_id)
+        ).scalar()
+    key = f"{engine.url}|{instance_id}".encode()
+    return hashlib.blake2b(key, digest_size=8).hexdigest()
+
+
+def check(engine):
+    """Raise SchemaOutdated unless every migration is applied"""
+    with engine.connect() as connection:
+        version = current_version(connection)
+    if version < LATEST:
+        raise SchemaOutdated(
+            f"Database schema is at version {version}, the app needs {LATEST}: "
+            "run `python -m src.manage migrate`"
+        )
+    if version > LATEST:
+        logger.warning(
+            "Database schema is at version %d, newer than %d", version, LATEST
+        )
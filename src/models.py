@@ -1,17 +1,19 @@
 from sqlalchemy import (
     Column,
     ForeignKey,
+    Index,
     Integer,
     String,
     Boolean,
     UniqueConstraint,
-    func,
+    and_,
     select,
 )
-from sqlalchemy.orm import relationship, object_session
-from .reaction_cache import cached_reactions_count
+from sqlalchemy.orm import aliased, relationship
+import os
 
 
+from . import reaction_buffer
 from .database import Base
 
 
@@ -40,6 +42,14 @@ class Post(Base):
     id = Column(Integer, primary_key=True, index=True, autoincrement=True)
     content = Column(String)
     author_id = Column(Integer, ForeignKey("users.id"))
+    # Denormalized counters, kept in sync by crud in the reaction's transaction
+    likes_count = Column(Integer, nullable=False, default=0, server_default="0")
+    dislikes_count = Column(Integer, nullable=False, default=0, server_default="0")
+    # Bumped by crud on every change of the serialized post, for ETags
+    revision = Column(Integer, nullable=False, default=0, server_default="0")
+
+    # Posts of authors newest first: user pages, timelines, User.recent_posts
+    __table_args__ = (Index("ix_posts_author_id_id", author_id, id.desc()),)
 
     author = relationship("User", back_populates="posts")
     reactions = relationship(
@@ -47,19 +57,12 @@ class Post(Base):
     )
 
     @property
-    @cached_reactions_count
     def reactions_count(self):
-        likes = object_session(self).scalar(
-            select(func.count(Reaction.id)).where(
-                Reaction.post_id == self.id, Reaction.is_like
-            )
-        )
-        dislikes = object_session(self).scalar(
-            select(func.count(Reaction.id)).where(
-                Reaction.post_id == self.id, Reaction.is_like == False
-            )
-        )
-        return {"likes": likes, "dislikes": dislikes}
+        likes, dislikes = reaction_buffer.buffer.pending_counts(self.id)
+        return {
+            "likes": self.likes_count + likes,
+            "dislikes": self.dislikes_count + dislikes,
+        }
 
 
 class Reaction(Base):
@@ -68,6 +71,37 @@ class Reaction(Base):
     from_id = Column(Integer, ForeignKey("users.id"))
     post_id = Column(Integer, ForeignKey("posts.id"))
     is_like = Column(Boolean)
-    __table_args__ = (UniqueConstraint("from_id", "post_id", name="from_to"),)
+    __table_args__ = (
+        UniqueConstraint("from_id", "post_id", name="from_to"),
+        # from_to leads with from_id: counts per post, deletes of a post
+        Index("ix_reactions_post_id_is_like", post_id, is_like),
+    )
     user = relationship("User", back_populates="reactions")
     post = relationship("Post", back_populates="reactions")
+
+
+# Number of latest posts embedded into user profiles
+USER_RECENT_POSTS = int(os.environ.get("USER_RECENT_POSTS") or 10)
+
+
+def _recent_post_ids(author_id):
+    """Ids of the latest posts of an author: a range of ix_posts_author_id_id"""
+    recent = aliased(Post)
+    return (
+        select(recent.id)
+        .where(recent.author_id == author_id)
+        .order_by(recent.id.desc())
+        .limit(USER_RECENT_POSTS)
+        .scalar_subquery()
+    )
+
+
+# Read-only, row-limited view of User.posts, meant for selectinload
+User.recent_posts = relationship(
+    Post,
+    primaryjoin=and_(
+        Post.author_id == User.id, Post.id.in_(_recent_post_ids(User.id))
+    ),
+    order_by=Post.id.desc(),
+    viewonly=True,
+)
@@ -0,0 +1,79 @@
+import base64
+import binascii
+
+from fastapi import HTTPException, Response
+
+from . import schemas
+
+
+def _encode(value: str) -> str:
+    return base64.urlsafe_b64encode(value.encode()).decode().rstrip("=")
+
+
+def _decode(cursor: str) -> str:
+    try:
+        padding = "=" * (-len(cursor) % 4)
+        return base64.urlsafe_b64decode(cursor + padding).decode()
+    except (binascii.Error, UnicodeDecodeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def encode_cursor(item_id: int) -> str:
+    return _encode(str(item_id))
+
+
+def decode_cursor(cursor: str | None) -> int | None:
+    if cursor is None:
+        return None
+    try:
+        return int(_decode(cursor))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def encode_search_cursor(rank: float, item_id: int) -> str:
+    """Cursor of a search result: its rank then its id"""
+    return _encode(f"{rank!r}:{item_id}")
+
+
+def decode_search_cursor(cursor: str | None) -> tuple[float, int] | None:
+    if cursor is None:
+        return None
+    try:
+        rank, item_id = _decode(cursor).split(":")
+        return float(rank), int(item_id)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def get_cursors(pagination_params: schemas.PaginationParams):
+    """Decoded (after, before) ids of the requested keyset page"""
+    after = decode_cursor(pagination_params.after)
+    before = decode_cursor(pagination_params.before)
+    if after is not None and before is not None:
+        raise HTTPException(
+            status_code=400, detail="Use either 'after' or 'before', not both"
+        )
+    if (after is not None or before is not None) and pagination_params.skip:
+        raise HTTPException(
+            status_code=400, detail="'skip' can not be combined with a cursor"
+        )
+    return after, before
+
+
+def set_cursor_headers(
+    response: Response, items: list, pagination_params: schemas.PaginationParams
+):
+    """
+    X-Next-Cursor continues the listing (pass it as 'after'),
+    X-Prev-Cursor goes back to the previous page (pass it as 'before').
+    Items must be in the listing order of the endpoint.
+    """
+    if not items:
+        return
+    page_is_full = len(items) == pagination_params.limit
+    going_back = pagination_params.before is not None
+    if page_is_full or going_back:
+        response.headers["X-Next-Cursor"] = encode_cursor(items[-1].id)
+    if (page_is_full and going_back) or pagination_params.after is not None:
+        response.headers["X-Prev-Cursor"] = encode_cursor(items[0].id)
@@ -0,0 +1,160 @@
+"""
+SQL profiler for development and staging.
+
+Records every statement executed during a request and groups them by shape,
+with literals and IN lists collapsed. A shape executed PROFILE_SQL_REPEAT
+times or more in one request is reported as an N+1 suspect: usually a lazy
+load in a loop. Routes declare how many statements they may execute with
+Depends(profiler.query_budget(n)); with QUERY_BUDGET_STRICT=true a request
+over its budget fails with QueryBudgetExceeded, which TestClient re-raises.
+"""
+import contextvars
+import logging
+import os
+import re
+import time
+
+from sqlalchemy import event
+
+PROFILE_SQL = (os.environ.get("PROFILE_SQL") or "false").lower() == "true"
+PROFILE_SQL_REPEAT = int(os.environ.get("PROFILE_SQL_REPEAT") or 3)
+QUERY_BUDGET_STRICT = (
+    os.environ.get("QUERY_BUDGET_STRICT") or "false"
+).lower() == "true"
+
+logger = logging.getLogger(__name__)
+
+_LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_IN_LISTS = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize(statement: str) -> str:
+    """Shape of a statement: same text for calls that only differ by values"""
+    statement = _WHITESPACE.sub(" ", statement).strip()
+    statement = _LITERALS.sub("?", statement)
+    return _IN_LISTS.sub("(?)", statement)
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+class Profile:
+    """Statements executed while answering one request"""
+
+    def __init__(self):
+        self.shapes = {}  # shape -> [executions, seconds]
+        self.budget = None
+
+    def record(self, statement: str, seconds: float):
+        shape = self.shapes.setdefault(normalize(statement), [0, 0.0])
+        shape[0] += 1
+        shape[1] += seconds
+
+    @property
+    def queries(self) -> int:
+        return sum(executions for executions, _ in self.shapes.values())
+
+    @property
+    def seconds(self) -> float:
+        return sum(seconds for _, seconds in self.shapes.values())
+
+    def suspects(self) -> list[tuple[str, int]]:
+        """Shapes repeated often enough to look like N+1 queries"""
+        return [
+            (shape, executions)
+            for shape, (executions, _) in self.shapes.items()
+            if executions >= PROFILE_SQL_REPEAT
+        ]
+
+    @property
+    def over_budget(self) -> bool:
+        return self.budget is not None and self.queries > self.budget
+
+    def report(self, method: str, path: str) -> str:
+        lines = [
+            f"{method} {path}: {self.queries} queries in {self.seconds * 1000:.1f} ms"
+            + ("" if self.budget is None else f" (budget {self.budget})")
+        ]
+        for shape, (executions, seconds) in sorted(
+            self.shapes.items(), key=lambda item: -item[1][0]
+        ):
+            lines.append(f"  {executions}x {seconds * 1000:.1f} ms  {shape}")
+        return "\n".join(lines)
+
+
+_profile = contextvars.ContextVar("sql_profile", default=None)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    context._profiler_start = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    profile = _profile.get()
+    if profile is not None:
+        profile.record(statement, time.perf_counter() - context._profiler_start)
+
+
+def instrument_engine(engine):
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+
+
+def query_budget(max_queries: int):
+    """Route dependency: the route may execute at most max_queries statements"""
+
+    async def set_budget():
+        profile = _profile.get()
+        if profile is not None:
+            profile.budget = max_queries
+
+    return set_budget
+
+
+class ProfilerMiddleware:
+    """
+    Adds X-SQL-Queries, X-SQL-Time-Ms and X-SQL-Repeated headers to responses
+    and logs a breakdown by shape of requests with N+1 suspects or over budget,
+    or of every request at DEBUG level
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        profile = Profile()
+        token = _profile.set(profile)
+
+        async def send_with_profile(message):
+            if message["type"] == "http.response.start":
+                # Handlers are done once the response starts
+                self.check(scope, profile)
+                suspects = profile.suspects()
+                message["headers"] = [
+                    *message.get("headers", []),
+                    (b"x-sql-queries", str(profile.queries).encode()),
+                    (b"x-sql-time-ms", f"{profile.seconds * 1000:.1f}".encode()),
+                    (b"x-sql-repeated", str(len(suspects)).encode()),
+                ]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_profile)
+        finally:
+            _profile.reset(token)
+
+    def check(self, scope, profile: Profile):
+        if not profile.suspects() and not profile.over_budget:
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(
+                    "SQL profile\n%s", profile.report(scope["method"], scope["path"])
+                )
+            return
+        report = profile.report(scope["method"], scope["path"])
+        if profile.over_budget and QUERY_BUDGET_STRICT:
+            raise QueryBudgetExceeded(report)
+        logger.warning("SQL profile\n%s", report)
@@ -0,0 +1,209 @@
+"""
+Write-behind reactions, enabled with REACTION_WRITE_BEHIND=true.
+
+Likes, dislikes and cancels are recorded here instead of being committed one
+by one. Repeated changes of the same reaction are coalesced, and reads add
+the pending changes to the stored counters, so they show at once. A
+background task writes everything pending in one transaction when
+REACTION_FLUSH_SIZE reactions are waiting or every REACTION_FLUSH_INTERVAL
+seconds, and once more on shutdown.
+
+Pending reactions live in the memory of one process: a crash loses at most
+one interval of them, and other workers see them once flushed.
+"""
+import asyncio
+import contextvars
+import logging
+import os
+import threading
+import time
+
+from fastapi.concurrency import run_in_threadpool
+
+from . import metrics
+from .database import SessionLocal
+
+REACTION_WRITE_BEHIND = (
+    os.environ.get("REACTION_WRITE_BEHIND") or "false"
+).lower() == "true"
+REACTION_FLUSH_SIZE = int(os.environ.get("REACTION_FLUSH_SIZE") or 500)
+REACTION_FLUSH_INTERVAL = float(os.environ.get("REACTION_FLUSH_INTERVAL") or 0.2)
+
+logger = logging.getLogger(__name__)
+
+MISSING = object()
+
+
+class ReactionBuffer:
+    """
+    Reactions changed but not committed yet: (from_id, post_id) ->
+    [stored, wanted], is_like or None for no reaction, stored being the
+    state in the database when the reaction was first buffered
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._flushing = {}  # Taken by the running flush
+        self._counts = {}  # post_id -> [likes, dislikes] not in the database yet
+        self.flushed_total = 0
+
+    def state(self, key):
+        """Latest buffered is_like/None of a reaction, or MISSING"""
+        with self._lock:
+            if key in self._pending:
+                return self._pending[key][1]
+            if key in self._flushing:
+                return self._flushing[key][1]
+            return MISSING
+
+    def _shift(self, post_id: int, is_like: bool | None, delta: int):
+        if is_like is None:
+            return
+        counts = self._counts.setdefault(post_id, [0, 0])
+        counts[0 if is_like else 1] += delta
+        if counts == [0, 0]:
+            del self._counts[post_id]
+
+    def apply(self, key, stored: bool | None, is_like: bool | None) -> bool:
+        """
+        Change a reaction to is_like, None to cancel it. stored is its state
+        in the database, used unless the reaction is already buffered.
+        Returns whether anything changed.
+        """
+        with self._lock:
+            entry = self._pending.get(key)
+            if entry is None:
+                if key in self._flushing:
+                    stored = self._flushing[key][1]
+                entry = [stored, stored]
+            current = entry[1]
+            if current is is_like:
+                return False
+            self._shift(key[1], current, -1)
+            self._shift(key[1], is_like, 1)
+            entry[1] = is_like
+            if entry[0] is entry[1]:
+                self._pending.pop(key, None)
+            else:
+                self._pending[key] = entry
+            depth = len(self._pending)
+        if depth >= REACTION_FLUSH_SIZE:
+            _wake_flusher()
+        return True
+
+    def pending_counts(self, post_id: int) -> tuple[int, int]:
+        """(likes, dislikes) to add to the stored counters of a post"""
+        counts = self._counts.get(post_id)
+        return (0, 0) if counts is None else tuple(counts)
+
+    def take(self) -> dict:
+        with self._lock:
+            self._flushing, self._pending = self._pending, {}
+            return dict(self._flushing)
+
+    def flushed(self):
+        """The taken reactions are committed, stop counting them"""
+        with self._lock:
+            for (_, post_id), (stored, wanted) in self._flushing.items():
+                self._shift(post_id, wanted, -1)
+                self._shift(post_id, stored, 1)
+            self.flushed_total += len(self._flushing)
+            self._flushing = {}
+
+    def restore(self):
+        """The flush failed, merge the taken reactions back"""
+        with self._lock:
+            for key, (stored, wanted) in self._flushing.items():
+                entry = self._pending.get(key)
+                if entry is None:
+                    self._pending[key] = [stored, wanted]
+                elif stored is entry[1]:
+                    del self._pending[key]
+                else:
+                    entry[0] = stored
+            self._flushing = {}
+
+    def depth(self) -> int:
+        return len(self._pending) + len(self._flushing)
+
+
+buffer = ReactionBuffer()
+
+_loop = None
+_wake = None
+_task = None
+_flush_lock = asyncio.Lock()
+
+
+def _wake_flusher():
+    # Called from the threadpool as well as from the event loop
+    if _loop is not None:
+        _loop.call_soon_threadsafe(_wake.set)
+
+
+def _write(changes: dict):
+    from . import crud  # crud imports models, which import this module
+
+    with SessionLocal() as db:
+        crud.flush_reactions(db, changes)
+
+
+async def flush():
+    """Commit every pending reaction"""
+    async with _flush_lock:
+        changes = buffer.take()
+        if not changes:
+            return
+        start = time.perf_counter()
+        try:
+            # Outside of the context of the request awaiting the flush, if any:
+            # its profiler and metrics must not count the reactions of others
+            await run_in_threadpool(contextvars.Context().run, _write, changes)
+        except BaseException:
+            buffer.restore()
+            raise
+        buffer.flushed()
+        if metrics.METRICS_ENABLED:
+            metrics.observe(
+                "reaction_flush_duration_seconds", time.perf_counter() - start
+            )
+
+
+async def _flush_forever():
+    while True:
+        try:
+            await asyncio.wait_for(_wake.wait(), REACTION_FLUSH_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
+        _wake.clear()
+        try:
+            await flush()
+        except Exception:
+            logger.exception("Could not flush reactions, retrying")
+
+
+def start():
+    global _loop, _wake, _task
+    _loop = asyncio.get_running_loop()
+    _wake = asyncio.Event()
+    _task = asyncio.create_task(_flush_forever())
+
+
+async def stop():
+    """Stop the background flush and commit what is left"""
+    global _loop, _task
+    if _task is not None:
+        # Not in the middle of a flush, whose thread would keep writing
+        async with _flush_lock:
+            _task.cancel()
+            try:
+                await _task
+            except asyncio.CancelledError:
+                pass
+        _loop = _task = None
+    await flush()
+
+
+def stats() -> dict:
+    return {"pending": buffer.depth(), "flushed": buffer.flushed_total}
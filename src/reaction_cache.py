@@ -1,16 +1,51 @@
-reaction_count_cache = {}
-reaction_cache = {}
+import os
 
+from sqlalchemy import select
+
+from . import models
+from .cache import database_cache_path, make_cache
+
+
+REACTION_CACHE_SIZE = int(os.environ.get("REACTION_CACHE_SIZE") or 100_000)
+REACTION_CACHE_TTL = float(os.environ.get("REACTION_CACHE_TTL") or 0) or None
+# "memory" is per process, "sqlite" is shared by all workers on the host
+REACTION_CACHE_BACKEND = os.environ.get("REACTION_CACHE_BACKEND") or "memory"
+REACTION_CACHE_PATH = os.environ.get("REACTION_CACHE_PATH")
+# Renamed when cached values changed, not to read the old ones
+REACTION_CACHE_NAME = "fastapisoc-reactions"
+
+# (from_id, post_id) -> is_like, or None if there is no reaction
+reaction_cache = make_cache(
+    REACTION_CACHE_BACKEND,
+    REACTION_CACHE_SIZE,
+    REACTION_CACHE_TTL,
+    path=REACTION_CACHE_PATH,
+    name=REACTION_CACHE_NAME,
+)
+
+
+def shared_path() -> str:
+    """File of the sqlite backend, whichever backend this process uses"""
+    return REACTION_CACHE_PATH or database_cache_path(REACTION_CACHE_NAME)
+
+_MISSING = object()
 
-def cached_reactions_count(func):
-    def wrapper(post_obj):
-        post_id = post_obj.id
-        cached = reaction_count_cache.get(post_id)
-        if not cached:
-            cached = func(post_obj)
-            reaction_count_cache[post_id] = cached
-        return cached
-    return wrapper
+
+def _compact(reaction_obj):
+    if reaction_obj is None:
+        return None
+    return reaction_obj.is_like
+
+
+def _restore(key, value):
+    """
+    Transient reaction built from the cache. Reactions are written by their
+    (from_id, post_id), so it does not need to be attached to the session.
+    """
+    if value is None:
+        return None
+    from_id, post_id = key
+    return models.Reaction(from_id=from_id, post_id=post_id, is_like=value)
 
 
 def update_reaction_cache(func):
@@ -20,40 +55,79 @@ def update_reaction_cache(func):
             return reaction_obj
         from_id = reaction_obj.from_id
         post_id = reaction_obj.post_id
-        try:
-            # To recalculate the number of reactions
-            del reaction_count_cache[post_id]
-        except KeyError:
-            pass
-        reaction_cache[(from_id, post_id)] = reaction_obj
+        reaction_cache[(from_id, post_id)] = _compact(reaction_obj)
         return reaction_obj
     return wrapper
 
 
 def delete_from_cache(func):
-    def wrapper(db_obj, reaction_obj):
-        from_id = reaction_obj.from_id
-        post_id = reaction_obj.post_id
-        try:
-            # To recalculate the number of reactions
-            del reaction_count_cache[post_id]
-        except KeyError:
-            pass
-        try:
-            del reaction_cache[(from_id, post_id)]
-        except KeyError:
-            pass
-        return func(db_obj, reaction_obj)
+    def wrapper(db_obj, post_obj, user_obj):
+        reaction_obj = func(db_obj, post_obj, user_obj)
+        if reaction_obj is not None:
+            reaction_cache[(user_obj.id, post_obj.id)] = None
+        return reaction_obj
+    return wrapper
+
+
+def delete_post_from_cache(func):
+    """Forget all reactions to a post deleted by the wrapped function"""
+    def wrapper(db_obj, post_obj):
+        post_id = post_obj.id
+        result = func(db_obj, post_obj)
+        # Once committed: until then, requests can cache the rows again
+        reaction_cache.discard_second([post_id])
+        return result
+    return wrapper
+
+
+def delete_user_from_cache(func):
+    """Forget all reactions of a user deleted by the wrapped function"""
+    def wrapper(db_obj, user_obj):
+        user_id = user_obj.id
+        # Ids only, the posts themselves are deleted in bulk
+        post_ids = db_obj.scalars(
+            select(models.Post.id).where(models.Post.author_id == user_id)
+        ).all()
+        result = func(db_obj, user_obj)
+        # Once committed: until then, requests can cache the rows again
+        reaction_cache.discard_first(user_id)
+        reaction_cache.discard_second(post_ids)
+        return result
+    return wrapper
+
+
+def forget_batch_reactions(func):
+    """Forget the reactions the wrapped batch function reports as changed"""
+    def wrapper(db_obj, operations, user_obj):
+        results = func(db_obj, operations, user_obj)
+        for result in results:
+            if result.changed:
+                reaction_cache.discard((user_obj.id, result.post_id))
+        return results
+    return wrapper
+
+
+def forget_flushed_reactions(func):
+    """Forget the buffered reactions committed by the wrapped function"""
+    def wrapper(db_obj, changes):
+        result = func(db_obj, changes)
+        for key in changes:
+            reaction_cache.discard(key)
+        return result
     return wrapper
 
 
 def get_from_cache(func):
     def wrapper(db_obj, post_obj, user_obj):
-        from_id = user_obj.id
-        post_id = post_obj.id
-        reaction_obj = reaction_cache.get((from_id, post_id))
-        if reaction_obj is None:
-            reaction_obj = func(db_obj, post_obj, user_obj)
-            reaction_cache[(from_id, post_id)] = reaction_obj
+        key = (user_obj.id, post_obj.id)
+        cached = reaction_cache.get(key, _MISSING)
+        if cached is not _MISSING:
+            return _restore(key, cached)
+        reaction_obj = func(db_obj, post_obj, user_obj)
+        reaction_cache[key] = _compact(reaction_obj)
         return reaction_obj
     return wrapper
+
+
+def stats() -> dict:
+    return reaction_cache.stats()
@@ -0,0 +1,73 @@
+"""
+Read replicas, enabled by setting DATABASE_REPLICA_URLS.
+
+GET routes read through deps.get_read_db, on the replicas in turn, while
+writes and authentication stay on the primary. Replicas lag behind it, so
+StickyPrimaryMiddleware answers every request that committed with a cookie
+sending the reads of the client to the primary for REPLICA_STICKY_SECONDS,
+to read its own writes. The cookie holds no server state, which works with
+any number of workers. Clients that drop cookies read from the replicas.
+
+`python -m src.manage sync-replicas` copies a SQLite primary to SQLite
+replicas, as a stand-in for replication when trying this out locally.
+"""
+import contextvars
+import os
+
+from fastapi import Request
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from . import database
+
+REPLICA_STICKY_SECONDS = int(os.environ.get("REPLICA_STICKY_SECONDS") or 5)
+STICKY_COOKIE = "read_primary"
+
+_committed = contextvars.ContextVar("committed", default=None)
+
+
+@event.listens_for(Session, "after_commit")
+def _after_commit(session):
+    # Commits also happen in the threadpool, which runs a copy of the context:
+    # the middleware sets a list rather than the variable
+    committed = _committed.get()
+    if committed is not None:
+        committed.append(True)
+
+
+def has_sticky_cookie(scope) -> bool:
+    """Whether a request, as an ASGI scope, was sent to the primary to read"""
+    return STICKY_COOKIE in Request(scope).cookies
+
+
+def reads_primary(request: Request) -> bool:
+    """Whether the reads of the request go to the primary"""
+    return not database.replica_engines or STICKY_COOKIE in request.cookies
+
+
+class StickyPrimaryMiddleware:
+    def __init__(self, app):
+        self.app = app
+        self.cookie = (
+            f"{STICKY_COOKIE}=1; Max-Age={REPLICA_STICKY_SECONDS}; Path=/; "
+            "HttpOnly; SameSite=Lax"
+        ).encode()
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        committed = []
+        token = _committed.set(committed)
+
+        async def send_with_cookie(message):
+            if message["type"] == "http.response.start" and committed:
+                message["headers"] = [
+                    *message.get("headers", []),
+                    (b"set-cookie", self.cookie),
+                ]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_cookie)
+        finally:
+            _committed.reset(token)
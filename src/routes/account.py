@@ -1,8 +1,17 @@
 from fastapi import APIRouter, Depends, HTTPException
 from .. import dependencies as deps
+from .. import profiler
 from .. import schemas
 from .. import crud
 from .. import security as sec
+from .. import serializers
+
+busy_response = {
+    503: {
+        "model": schemas.HTTPError,
+        "description": "Too many password checks in progress",
+    },
+}
 
 router = APIRouter(
     tags=["account"],
@@ -11,16 +20,19 @@ router = APIRouter(
             "model": schemas.HTTPError,
             "description": "Wrong login or password",
         },
+        **busy_response,
     },
 )
 
 signup_router = APIRouter(
     tags=["account"],
+    responses=busy_response,
 )
 
 
 @signup_router.post(
     "/signup/",
+    dependencies=[Depends(profiler.query_budget(2))],
     response_model=schemas.User,
     responses={
         409: {
@@ -29,77 +41,90 @@ signup_router = APIRouter(
         },
     },
 )
-def sign_up(user: schemas.UserCredentials, db=Depends(deps.get_db)):
+async def sign_up(user: schemas.UserCredentials, db=Depends(deps.get_db)):
     """Register a new account"""
-    db_user = crud.get_user_by_username(db, username=user.username)
+    db_user = await db.run(crud.get_user_by_username, username=user.username)
     if db_user:
         raise HTTPException(
             status_code=409,
             detail="Username already registered",
             headers={"WWW-Authenticate": "Bearer"},
         )
-    return crud.create_user(db=db, user=user)
+    hashed_password = await sec.get_password_hash_async(user.password)
+    return await db.run(
+        crud.create_user, user=user, hashed_password=hashed_password
+    )
 
 
 @router.post(
     "/token/",
+    dependencies=[Depends(profiler.query_budget(1))],
     response_model=schemas.Token,
 )
-def login_for_JWT_from_JSON(
+async def login_for_JWT_from_JSON(
     user: schemas.User = Depends(deps.authenticate_user),
 ):
     """
     Sign in for JWT token with JSON request body.
     Use /tokenform/ when using interactive docs
     """
-    access_token = sec.create_access_token(data={"sub": user.username})
+    access_token = sec.create_access_token(
+        data={"sub": user.username, "uid": user.id}
+    )
     return {"access_token": access_token, "token_type": "bearer"}
 
 
 @router.post(
     "/tokenform/",
+    dependencies=[Depends(profiler.query_budget(1))],
     response_model=schemas.Token,
 )
-def login_for_JWT_from_FORM(
+async def login_for_JWT_from_FORM(
     user: schemas.User = Depends(deps.authenticate_user_from_OAuth2),
 ):
     """
     Sign in for JWT token with Post Form
     This method is preferred when using interactive docs
     """
-    access_token = sec.create_access_token(data={"sub": user.username})
+    access_token = sec.create_access_token(
+        data={"sub": user.username, "uid": user.id}
+    )
     return {"access_token": access_token, "token_type": "bearer"}
 
 
 @router.put(
     "/edit/",
+    dependencies=[Depends(profiler.query_budget(3))],
     response_model=schemas.User,
 )
-def update_credentials(
+async def update_credentials(
     new_credentials: schemas.UserCredentials,
     db=Depends(deps.get_db),
     user: schemas.User = Depends(deps.authenticate_user),
 ):
     """Update your username or/and password"""
-    user = crud.update_user(db, user, new_credentials)
+    hashed_password = await sec.get_password_hash_async(new_credentials.password)
+    user = await db.run(crud.update_user, user, new_credentials, hashed_password)
     return user
 
 
 @router.delete(
     "/delete/",
+    dependencies=[Depends(profiler.query_budget(8))],
     response_model=schemas.Success,
 )
-def delete_account(
+async def delete_account(
     db=Depends(deps.get_db),
     user: schemas.User = Depends(deps.authenticate_user),
 ):
     """Delete your account, your reactions, your posts and reactions to them"""
-    crud.delete_user(db, user)
+    await db.run(crud.delete_user, user)
     return schemas.Success(result="Success")
 
 
 @router.get(
     "/me/",
+    dependencies=[Depends(profiler.query_budget(3))],
     response_model=schemas.User,
     responses={
         401: {
@@ -108,9 +133,13 @@ def delete_account(
         },
     },
 )
-def get_current_user(
+async def get_current_user(
     db=Depends(deps.get_db), current_user=Depends(deps.get_current_user)
 ):
     """Your user profile"""
-    db_user = crud.get_user(db, user_id=current_user.id)
+    db_user = await db.run(crud.get_user, user_id=current_user.id)
+    if serializers.FAST_SERIALIZATION:
+        return serializers.JSONResponse(
+            serializers.user(db_user, db_user.recent_posts)
+        )
     return db_user
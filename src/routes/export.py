@@ -0,0 +1,54 @@
+from fastapi import APIRouter, Depends, Query, Request
+from fastapi.responses import StreamingResponse
+from .. import database
+from .. import dependencies as deps
+from .. import export
+from .. import profiler
+from .. import schemas
+
+router = APIRouter(
+    tags=["export"],
+    responses={
+        401: {
+            "model": schemas.HTTPError,
+            "description": "Unauthorized",
+        },
+    },
+)
+
+
+@router.get(
+    "/{table}/",
+    dependencies=[
+        Depends(profiler.query_budget(1)),
+        Depends(deps.get_current_user),
+    ],
+    response_class=StreamingResponse,
+    responses={
+        200: {
+            "content": {"application/x-ndjson": {}},
+            "description": "One JSON object per row, gzipped if accepted",
+        },
+    },
+)
+async def export_table(
+    table: schemas.ExportTable,
+    request: Request,
+    after: int | None = Query(
+        default=None, description="Id of the last row received, to resume"
+    ),
+    db=Depends(deps.get_db),
+):
+    """
+    Stream every row of a table as NDJSON, in id order.
+    Rows are read in chunks from one query, so any table size takes the same
+    memory. Accept-Encoding: gzip compresses the stream on the fly
+    """
+    # The stream reads on its own connection, don't hold the request's
+    await db.release()
+    body = export.ndjson(database.read_engine(), table, after)
+    headers = {"Vary": "Accept-Encoding"}
+    if "gzip" in request.headers.get("accept-encoding", ""):
+        body = export.gzipped(body)
+        headers["Content-Encoding"] = "gzip"
+    return StreamingResponse(body, media_type="application/x-ndjson", headers=headers)
@@ -1,8 +1,14 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Body, Depends, HTTPException, Query, Request, Response
 from .. import dependencies as deps
+from .. import profiler
 from .. import schemas
 from .. import crud
+from .. import etags
 from .. import models
+from .. import pagination
+from .. import reaction_buffer
+from .. import search
+from .. import serializers
 
 
 manage_post_router = APIRouter(
@@ -26,38 +32,158 @@ manage_post_router = APIRouter(
 
 router = APIRouter(tags=["posts"])
 
+# Operations accepted by one /reactions/batch request
+REACTION_BATCH_SIZE = 100
+# Authors merged by one /timeline/ request
+TIMELINE_MAX_AUTHORS = 100
+
 
 @router.get(
     "/",
+    dependencies=[Depends(profiler.query_budget(1))],
+    response_model=list[schemas.Post],
+    responses=etags.not_modified_response,
+)
+async def post_feed(
+    request: Request,
+    response: Response,
+    pagination_params=Depends(schemas.PaginationParams),
+    db=Depends(deps.get_read_db),
+):
+    """
+    Get posts, newest first.
+    Page with skip/limit, or with the X-Next-Cursor and X-Prev-Cursor
+    response headers passed back as after/before
+    """
+    after, before = pagination.get_cursors(pagination_params)
+    fast = serializers.FAST_SERIALIZATION
+    posts = await db.run(
+        crud.get_post_rows if fast else crud.get_posts,
+        skip=pagination_params.skip,
+        limit=pagination_params.limit,
+        after=after,
+        before=before,
+    )
+    etag = etags.posts_etag(posts)
+    if etags.is_fresh(request, etag):
+        return etags.not_modified(etag, "feed")
+    if fast:
+        # A returned response doesn't get the headers set on the parameter
+        response = serializers.JSONResponse(serializers.posts(posts))
+    etags.set_headers(response, etag, "feed")
+    pagination.set_cursor_headers(response, posts, pagination_params)
+    return response if fast else posts
+
+
+@router.get(
+    "/timeline/",
+    dependencies=[Depends(profiler.query_budget(1))],
+    response_model=list[schemas.Post],
+)
+async def get_timeline(
+    response: Response,
+    author_ids: list[int] = Query(
+        ...,
+        alias="author_id",
+        min_items=1,
+        max_items=TIMELINE_MAX_AUTHORS,
+        description="Repeated for every author",
+    ),
+    pagination_params=Depends(schemas.PaginationParams),
+    db=Depends(deps.get_read_db),
+):
+    """
+    Get the posts of several authors merged, newest first, like a home
+    feed of followed users.
+    Page with skip/limit, or with the X-Next-Cursor and X-Prev-Cursor
+    response headers passed back as after/before
+    """
+    after, before = pagination.get_cursors(pagination_params)
+    fast = serializers.FAST_SERIALIZATION
+    posts = await db.run(
+        crud.get_timeline_rows if fast else crud.get_timeline,
+        author_ids,
+        skip=pagination_params.skip,
+        limit=pagination_params.limit,
+        after=after,
+        before=before,
+    )
+    if fast:
+        response = serializers.JSONResponse(serializers.posts(posts))
+    pagination.set_cursor_headers(response, posts, pagination_params)
+    return response if fast else posts
+
+
+@router.get(
+    "/search",
+    dependencies=[Depends(profiler.query_budget(1))],
     response_model=list[schemas.Post],
+    responses={
+        400: {
+            "model": schemas.HTTPError,
+            "description": "No words in q, or invalid cursor",
+        },
+    },
 )
-def post_feed(
-    pagination_params=Depends(schemas.PaginationParams), db=Depends(deps.get_db)
+async def search_posts(
+    response: Response,
+    search_params=Depends(schemas.SearchParams),
+    db=Depends(deps.get_read_db),
 ):
-    """Get posts"""
-    posts = crud.get_posts(
-        db, skip=pagination_params.skip, limit=pagination_params.limit
+    """
+    Find posts containing every word of q, best matches first.
+    Get the next page with the X-Next-Cursor response header passed back as after
+    """
+    search_terms = search.terms(search_params.q)
+    if not search_terms:
+        raise HTTPException(status_code=400, detail="No words to search for")
+    after = pagination.decode_search_cursor(search_params.after)
+    results = await db.run(
+        crud.search_posts, search_terms, limit=search_params.limit, after=after
     )
-    return posts
+    posts = [post for post, _ in results]
+    if serializers.FAST_SERIALIZATION:
+        response = serializers.JSONResponse(serializers.posts(posts))
+    if len(results) == search_params.limit:
+        last_post, rank = results[-1]
+        response.headers["X-Next-Cursor"] = pagination.encode_search_cursor(
+            rank, last_post.id
+        )
+    return response if serializers.FAST_SERIALIZATION else posts
 
 
 @router.get(
     "/{post_id}/",
+    dependencies=[Depends(profiler.query_budget(1))],
     response_model=schemas.Post,
     responses={
         404: {
             "model": schemas.HTTPError,
             "description": "Post not found",
         },
+        **etags.not_modified_response,
     },
 )
-def get_single_post(post=Depends(deps.get_post_by_id), db=Depends(deps.get_db)):
+async def get_single_post(
+    request: Request,
+    response: Response,
+    post=Depends(deps.read_post_by_id),
+):
     """Get single post by id"""
+    etag = etags.post_etag(post)
+    if etags.is_fresh(request, etag):
+        return etags.not_modified(etag, "post")
+    if serializers.FAST_SERIALIZATION:
+        response = serializers.JSONResponse(serializers.post(post))
+        etags.set_headers(response, etag, "post")
+        return response
+    etags.set_headers(response, etag, "post")
     return post
 
 
 @router.post(
     "/new/",
+    dependencies=[Depends(profiler.query_budget(3))],
     response_model=schemas.Post,
     responses={
         401: {
@@ -66,21 +192,22 @@ def get_single_post(post=Depends(deps.get_post_by_id), db=Depends(deps.get_db)):
         },
     },
 )
-def new_post(
+async def new_post(
     content: schemas.NewPost,
     db=Depends(deps.get_db),
     current_user=Depends(deps.get_current_user),
 ):
     """Create new post"""
-    post = crud.create_post(db, post=content, user_id=current_user.id)
+    post = await db.run(crud.create_post, post=content, user_id=current_user.id)
     return post
 
 
 @manage_post_router.put(
     "/{post_id}/",
+    dependencies=[Depends(profiler.query_budget(4))],
     response_model=schemas.Post,
 )
-def edit_post(
+async def edit_post(
     content: schemas.NewPost,
     post=Depends(deps.get_post_by_id),
     db=Depends(deps.get_db),
@@ -92,15 +219,16 @@ def edit_post(
             status_code=403,
             detail="Forbidden",
         )
-    updated_post = crud.update_post(db, content, post)
+    updated_post = await db.run(crud.update_post, content, post)
     return updated_post
 
 
 @manage_post_router.delete(
     "/{post_id}/",
+    dependencies=[Depends(profiler.query_budget(4))],
     response_model=schemas.Success,
 )
-def delete_post(
+async def delete_post(
     post=Depends(deps.get_post_by_id),
     db=Depends(deps.get_db),
     current_user=Depends(deps.get_current_user),
@@ -111,16 +239,17 @@ def delete_post(
             status_code=403,
             detail="Forbidden",
         )
-    crud.delete_post(db, post)
+    await db.run(crud.delete_post, post)
     return schemas.Success(result="Success")
 
 
 @manage_post_router.patch(
     "/{post_id}/like",
+    dependencies=[Depends(profiler.query_budget(4))],
     response_model=schemas.Success,
     tags=["reactions"],
 )
-def like_post(
+async def like_post(
     post: models.Post = Depends(deps.get_post_by_id),
     db=Depends(deps.get_db),
     current_user=Depends(deps.get_current_user),
@@ -136,7 +265,10 @@ def like_post(
             status_code=403,
             detail="You can't add reactions to your own posts.",
         )
-    reacted = crud.add_reaction(db, is_like, post, current_user)
+    if reaction_buffer.REACTION_WRITE_BEHIND:
+        reacted = await db.run(crud.buffer_reaction, is_like, post, current_user)
+    else:
+        reacted = await db.run(crud.add_reaction, is_like, post, current_user)
     return (
         schemas.Success(result="Success")
         if reacted
@@ -146,10 +278,11 @@ def like_post(
 
 @manage_post_router.patch(
     "/{post_id}/dislike",
+    dependencies=[Depends(profiler.query_budget(4))],
     response_model=schemas.Success,
     tags=["reactions"],
 )
-def dislike_post(
+async def dislike_post(
     post=Depends(deps.get_post_by_id),
     db=Depends(deps.get_db),
     current_user=Depends(deps.get_current_user),
@@ -165,7 +298,10 @@ def dislike_post(
             status_code=403,
             detail="You can't add reactions to your own posts.",
         )
-    reacted = crud.add_reaction(db, is_like, post, current_user)
+    if reaction_buffer.REACTION_WRITE_BEHIND:
+        reacted = await db.run(crud.buffer_reaction, is_like, post, current_user)
+    else:
+        reacted = await db.run(crud.add_reaction, is_like, post, current_user)
     return (
         schemas.Success(result="Success")
         if reacted
@@ -175,20 +311,48 @@ def dislike_post(
 
 @manage_post_router.patch(
     "/{post_id}/cancel",
+    dependencies=[Depends(profiler.query_budget(4))],
     response_model=schemas.Success,
     tags=["reactions"],
 )
-def remove_reaction(
+async def remove_reaction(
     post=Depends(deps.get_post_by_id),
     db=Depends(deps.get_db),
     current_user=Depends(deps.get_current_user),
 ):
     """Delete your reaction to someone else's post"""
-    reaction = crud.get_reaction(db, post, current_user)
-    if reaction is None:
+    if reaction_buffer.REACTION_WRITE_BEHIND:
+        cancelled = await db.run(crud.buffer_reaction, None, post, current_user)
+    else:
+        reaction = await db.run(crud.delete_reaction, post, current_user)
+        cancelled = reaction is not None
+    if not cancelled:
         raise HTTPException(
             status_code=404,
             detail="Reaction not found",
         )
-    crud.delete_reaction(db, reaction)
     return schemas.Success(result="Success")
+
+
+@manage_post_router.post(
+    "/reactions/batch",
+    dependencies=[Depends(profiler.query_budget(6))],
+    response_model=list[schemas.ReactionResult],
+    tags=["reactions"],
+)
+async def batch_reactions(
+    operations: list[schemas.ReactionOperation] = Body(
+        ..., max_items=REACTION_BATCH_SIZE
+    ),
+    db=Depends(deps.get_db),
+    current_user=Depends(deps.get_current_user),
+):
+    """
+    Like, dislike or cancel reactions to several posts at once, in order.
+    Operations are applied in one transaction and answered one by one,
+    with the results the single reaction endpoints would give
+    """
+    if reaction_buffer.REACTION_WRITE_BEHIND:
+        # Apply the operations to the latest state of the reactions
+        await reaction_buffer.flush()
+    return await db.run(crud.apply_reactions, operations, current_user)
@@ -0,0 +1,46 @@
+from fastapi import APIRouter
+from .. import schemas
+from .. import reaction_cache
+from .. import token_cache
+from .. import feed_cache
+from .. import database
+
+router = APIRouter(
+    tags=["stats"],
+)
+
+
+@router.get(
+    "/reaction-cache/",
+    response_model=schemas.CacheStats,
+)
+def get_reaction_cache_stats():
+    """Size and hit/miss/eviction counters of the reaction cache"""
+    return reaction_cache.stats()
+
+
+@router.get(
+    "/token-cache/",
+    response_model=schemas.CacheStats,
+)
+def get_token_cache_stats():
+    """Size and hit/miss/eviction counters of the verified token cache"""
+    return token_cache.stats()
+
+
+@router.get(
+    "/feed-cache/",
+    response_model=schemas.CacheStats,
+)
+def get_feed_cache_stats():
+    """Size and hit/miss/eviction counters of the anonymous feed page cache"""
+    return feed_cache.stats()
+
+
+@router.get(
+    "/db-pool/",
+    response_model=schemas.PoolStats,
+)
+def get_db_pool_stats():
+    """Connections in use and time spent waiting for a free one"""
+    return database.get_pool_stats()
@@ -1,40 +1,122 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Request, Response
 from .. import dependencies as deps
+from .. import profiler
 from .. import schemas
 from .. import crud
+from .. import etags
+from .. import pagination
+from .. import serializers
 
 router = APIRouter(
     tags=["users"],
 )
 
 
-@router.get("/", response_model=list[schemas.User])
-def list_users(
-    pagination_params=Depends(schemas.PaginationParams), db=Depends(deps.get_db)
+@router.get(
+    "/",
+    dependencies=[Depends(profiler.query_budget(2))],
+    response_model=list[schemas.User],
+)
+async def list_users(
+    response: Response,
+    pagination_params=Depends(schemas.PaginationParams),
+    db=Depends(deps.get_read_db),
 ):
-    """Get users"""
-    users = crud.get_users(
-        db, skip=pagination_params.skip, limit=pagination_params.limit
+    """
+    Get users, oldest first.
+    Page with skip/limit, or with the X-Next-Cursor and X-Prev-Cursor
+    response headers passed back as after/before
+    """
+    after, before = pagination.get_cursors(pagination_params)
+    fast = serializers.FAST_SERIALIZATION
+    users = await db.run(
+        crud.get_user_rows if fast else crud.get_users,
+        skip=pagination_params.skip,
+        limit=pagination_params.limit,
+        after=after,
+        before=before,
     )
-    return users
+    if fast:
+        users, posts = users
+        # A returned response doesn't get the headers set on the parameter
+        response = serializers.JSONResponse(serializers.users(users, posts))
+    pagination.set_cursor_headers(response, users, pagination_params)
+    return response if fast else users
 
 
 @router.get(
     "/{user_id}/",
+    dependencies=[Depends(profiler.query_budget(2))],
     response_model=schemas.User,
     responses={
         404: {
             "model": schemas.HTTPError,
             "description": "User not found",
         },
+        **etags.not_modified_response,
     },
 )
-def get_user(user_id: int, db=Depends(deps.get_db)):
-    """Get user by id"""
-    db_user = crud.get_user(db, user_id=user_id)
+async def get_user(
+    user_id: int, request: Request, response: Response, db=Depends(deps.get_read_db)
+):
+    """Get user by id, with the latest posts"""
+    db_user = await db.run(crud.get_user, user_id=user_id)
     if db_user is None:
         raise HTTPException(
             status_code=404,
             detail="User not found",
         )
+    etag = etags.user_etag(db_user, db_user.recent_posts)
+    if etags.is_fresh(request, etag):
+        return etags.not_modified(etag, "user")
+    if serializers.FAST_SERIALIZATION:
+        response = serializers.JSONResponse(
+            serializers.user(db_user, db_user.recent_posts)
+        )
+        etags.set_headers(response, etag, "user")
+        return response
+    etags.set_headers(response, etag, "user")
     return db_user
+
+
+@router.get(
+    "/{user_id}/posts/",
+    dependencies=[Depends(profiler.query_budget(2))],
+    response_model=list[schemas.Post],
+    responses={
+        404: {
+            "model": schemas.HTTPError,
+            "description": "User not found",
+        },
+    },
+)
+async def get_user_posts(
+    user_id: int,
+    response: Response,
+    pagination_params=Depends(schemas.PaginationParams),
+    db=Depends(deps.get_read_db),
+):
+    """
+    Get all posts of a user, newest first.
+    Page with skip/limit, or with the X-Next-Cursor and X-Prev-Cursor
+    response headers passed back as after/before
+    """
+    after, before = pagination.get_cursors(pagination_params)
+    fast = serializers.FAST_SERIALIZATION
+    posts = await db.run(
+        crud.get_user_post_rows if fast else crud.get_user_posts,
+        user_id=user_id,
+        skip=pagination_params.skip,
+        limit=pagination_params.limit,
+        after=after,
+        before=before,
+    )
+    if not posts and await db.run(crud.get_user_by_id, user_id=user_id) is None:
+        raise HTTPException(
+            status_code=404,
+            detail="User not found",
+        )
+    if fast:
+        response = serializers.JSONResponse(serializers.posts(posts))
+    pagination.set_cursor_headers(response, posts, pagination_params)
+    return response if fast else posts
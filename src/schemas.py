@@ -1,5 +1,6 @@
 from pydantic import BaseModel, Field
-from typing import Optional
+from pydantic.utils import GetterDict
+from typing import Literal, Optional
 
 
 class Message(BaseModel):
@@ -28,6 +29,18 @@ class Post(PostBase):
         orm_mode = True
 
 
+class ReactionOperation(BaseModel):
+    post_id: int
+    action: Literal["like", "dislike", "cancel"]
+
+
+class ReactionResult(ReactionOperation):
+    result: str = Field(
+        ..., description="Outcome, worded like the single reaction endpoints"
+    )
+    changed: bool
+
+
 class UserBase(BaseModel):
     username: str
 
@@ -36,12 +49,22 @@ class UserCredentials(UserBase):
     password: str
 
 
+class UserGetter(GetterDict):
+    """Embed the capped User.recent_posts instead of every post of the user"""
+
+    def get(self, key, default=None):
+        if key == "posts":
+            key = "recent_posts"
+        return super().get(key, default)
+
+
 class User(UserBase):
     id: int
-    posts: list[Post] = []
+    posts: list[Post] = Field([], description="Latest posts of the user")
 
     class Config:
         orm_mode = True
+        getter_dict = UserGetter
 
 
 class Token(BaseModel):
@@ -51,11 +74,34 @@ class Token(BaseModel):
 
 class TokenData(BaseModel):
     username: str | None = None
+    user_id: int | None = None
+
+
+class CurrentUser(UserBase):
+    """Identity of an authenticated user, enough to authorize a request"""
+    id: int
 
 
 class PaginationParams(BaseModel):
     skip: Optional[int] = Field(default=0, ge=0)
     limit: Optional[int] = Field(default=50, gt=0, le=100)
+    after: Optional[str] = Field(
+        default=None, description="Page following this cursor (X-Next-Cursor)"
+    )
+    before: Optional[str] = Field(
+        default=None, description="Page preceding this cursor (X-Prev-Cursor)"
+    )
+
+
+class SearchParams(BaseModel):
+    q: str = Field(min_length=1, max_length=200, description="Words to search for")
+    limit: Optional[int] = Field(default=50, gt=0, le=100)
+    after: Optional[str] = Field(
+        default=None, description="Page following this cursor (X-Next-Cursor)"
+    )
+
+
+ExportTable = Literal["posts", "users", "reactions"]
 
 
 class HTTPError(BaseModel):
@@ -69,3 +115,24 @@ class HTTPError(BaseModel):
 
 class Success(BaseModel):
     result: str
+
+
+class CacheStats(BaseModel):
+    size: int
+    max_size: int
+    hits: int
+    misses: int
+    evictions: int
+    hit_ratio: float
+
+
+class PoolStats(BaseModel):
+    checkouts: int
+    timeouts: int
+    wait_seconds_total: float
+    wait_seconds_max: float
+    size: int
+    checked_out: int
+    overflow: int
+    capacity: int
+    saturation: float
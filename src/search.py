@@ -0,0 +1,129 @@
+"""
+Full-text search over posts.
+
+On SQLite with FTS5, the content of every post is copied into posts_fts, an
+FTS5 table whose rowid is the post id. The newest SEARCH_RANK_WINDOW matches
+are ranked by bm25, older ones follow newest first: scoring all the posts
+containing a frequent word takes long. The index is created by a migration,
+crud updates it in the transaction of each post write, and rebuild() refills
+it from the posts table, see `python -m src.manage rebuild-search`. Other databases fall back to a
+case-insensitive LIKE per term, newest first, which scans posts.
+"""
+import logging
+import os
+import re
+
+from sqlalchemy import Column, Float, Integer, MetaData, String, Table
+from sqlalchemy import func, select, text
+from sqlalchemy.exc import OperationalError
+
+from . import models
+
+logger = logging.getLogger(__name__)
+
+SEARCH_RANK_WINDOW = int(os.environ.get("SEARCH_RANK_WINDOW") or 1000)
+# Words of a query used for the search, the others are ignored
+SEARCH_MAX_TERMS = 8
+
+# Apart from models.Base.metadata: create_all can't create virtual tables
+_metadata = MetaData()
+posts_fts = Table(
+    "posts_fts",
+    _metadata,
+    Column("rowid", Integer, primary_key=True),
+    Column("content", String),
+    Column("rank", Float),  # Hidden column: bm25 of the match, lower is better
+)
+
+_TERMS = re.compile(r"\w+")
+
+# Whether posts_fts is in use, set by enable()
+FTS5 = False
+
+
+def terms(q: str) -> list[str]:
+    """Words to search for in a query, without FTS5 syntax"""
+    return _TERMS.findall(q.lower())[:SEARCH_MAX_TERMS]
+
+
+def match_expression(search_terms: list[str]) -> str:
+    """FTS5 query matching posts containing every term"""
+    # Terms are made of word characters only, quoting them is enough
+    return " ".join(f'"{term}"' for term in search_terms)
+
+
+def create_index(connection) -> bool:
+    """
+    Create posts_fts on SQLite, filled from the posts table if it is new.
+    Returns whether full-text search is available.
+    """
+    if connection.dialect.name != "sqlite":
+        return False
+    if not _exists(connection):
+        try:
+            connection.execute(
+                text(
+                    "CREATE VIRTUAL TABLE posts_fts USING fts5("
+                    "content, tokenize = 'unicode61 remove_diacritics 2')"
+                )
+            )
+        except OperationalError as error:
+            if "no such module" not in str(error):
+                raise
+            logger.warning("SQLite has no FTS5, search falls back to LIKE")
+            return False
+        logger.info("Indexed %d posts for search", rebuild(connection))
+    return True
+
+
+def _exists(connection) -> bool:
+    return (
+        connection.execute(
+            text("SELECT 1 FROM sqlite_master WHERE name = 'posts_fts'")
+        ).first()
+        is not None
+    )
+
+
+def enable(engine) -> bool:
+    """Use posts_fts if the database has it, returns whether it does"""
+    global FTS5
+    FTS5 = False
+    if engine.dialect.name == "sqlite":
+        with engine.connect() as connection:
+            FTS5 = _exists(connection)
+    return FTS5
+
+
+def rebuild(connection) -> int:
+    """Index all posts again, returns their number"""
+    connection.execute(posts_fts.delete())
+    connection.execute(
+        posts_fts.insert().from_select(
+            ["rowid", "content"], select(models.Post.id, models.Post.content)
+        )
+    )
+    connection.execute(text("INSERT INTO posts_fts (posts_fts) VALUES ('optimize')"))
+    return connection.execute(select(func.count()).select_from(posts_fts)).scalar()
+
+
+def index_post(db, post: models.Post):
+    """Index a new post, in the transaction creating it"""
+    if FTS5:
+        db.flush()  # For the id
+        db.execute(posts_fts.insert().values(rowid=post.id, content=post.content))
+
+
+def reindex_post(db, post_id: int, content: str):
+    if FTS5:
+        db.execute(
+            posts_fts.update()
+            .where(posts_fts.c.rowid == post_id)
+            .values(content=content)
+        )
+
+
+def unindex_posts(db, post_ids):
+    """Remove posts from the index: a list of ids, or a SELECT of them"""
+    if FTS5:
+        db.execute(posts_fts.delete().where(posts_fts.c.rowid.in_(post_ids)))
@@ -1,11 +1,34 @@
-from . import schemas
+from . import metrics, schemas
 from passlib.context import CryptContext
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime, timedelta
+from fastapi import HTTPException, status
+from fastapi.concurrency import run_in_threadpool
 from fastapi.security import OAuth2PasswordBearer
 from jose import JWTError, jwt
+import asyncio
+import multiprocessing
 import os
+import time
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# Cost of new hashes, existing hashes keep their own
+BCRYPT_ROUNDS = int(os.environ.get('BCRYPT_ROUNDS') or 12)
+# Worker processes of the app, which uvicorn --workers defaults to
+WEB_CONCURRENCY = int(os.environ.get('WEB_CONCURRENCY') or 1)
+# Processes hashing and verifying passwords in each worker, 0 to use the
+# threadpool instead. By default the workers share the CPUs
+PASSWORD_HASH_WORKERS = int(
+    os.environ.get('PASSWORD_HASH_WORKERS')
+    or max((os.cpu_count() or 1) // WEB_CONCURRENCY, 1)
+)
+# Calls allowed to wait for a free worker before answering 503
+PASSWORD_HASH_QUEUE = int(
+    os.environ.get('PASSWORD_HASH_QUEUE') or 4 * max(PASSWORD_HASH_WORKERS, 1)
+)
+
+pwd_context = CryptContext(
+    schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=BCRYPT_ROUNDS
+)
 # Do not use default value in production
 SECRET_KEY = os.environ.get('SECRET_KEY') or "09d25e094faa6ca2556c818166b7a9563b93f7099f6f0f4caa6cf63b88e8d3e7"
 ALGORITHM = "HS256"
@@ -22,6 +45,70 @@ def get_password_hash(password):
     return pwd_context.hash(password)
 
 
+_hash_pool = None
+_hash_calls = 0  # running and queued, only touched from the event loop
+
+
+def start_hash_pool():
+    """
+    Create the password hashing pool, at startup. Its processes are forked
+    by a forkserver, a clean single-threaded process: forking the app once
+    its threads run could copy a lock held by one of them.
+    """
+    global _hash_pool
+    if _hash_pool is None and PASSWORD_HASH_WORKERS > 0:
+        _hash_pool = ProcessPoolExecutor(
+            max_workers=PASSWORD_HASH_WORKERS,
+            mp_context=multiprocessing.get_context("forkserver"),
+        )
+    return _hash_pool
+
+
+def shutdown_hash_pool():
+    global _hash_pool
+    if _hash_pool is not None:
+        _hash_pool.shutdown(cancel_futures=True)
+        _hash_pool = None
+
+
+async def _run_bcrypt(func, *args):
+    """
+    Run func in the password hashing pool.
+    Answer 503 at once when the pool and its queue are full, rather than
+    let logins pile up behind each other.
+    """
+    global _hash_calls
+    if _hash_calls >= max(PASSWORD_HASH_WORKERS, 1) + PASSWORD_HASH_QUEUE:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Too many password checks in progress, try again later",
+            headers={"Retry-After": "1"},
+        )
+    _hash_calls += 1
+    start = time.perf_counter()
+    try:
+        if PASSWORD_HASH_WORKERS == 0:
+            return await run_in_threadpool(func, *args)
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(start_hash_pool(), func, *args)
+    finally:
+        _hash_calls -= 1
+        if metrics.METRICS_ENABLED:
+            metrics.observe(
+                "password_hash_duration_seconds",
+                time.perf_counter() - start,
+                (func.__name__,),
+            )
+
+
+async def verify_password_async(plain_password, hashed_password):
+    return await _run_bcrypt(verify_password, plain_password, hashed_password)
+
+
+async def get_password_hash_async(password):
+    return await _run_bcrypt(get_password_hash, password)
+
+
 def create_access_token(data: dict, expires_delta: timedelta | None = None):
     to_encode = data.copy()
     if expires_delta:
@@ -33,13 +120,14 @@ def create_access_token(data: dict, expires_delta: timedelta | None = None):
     return encoded_jwt
 
 
-def verify_jwt_token(token: str) -> str | None:
-    username = None
+def verify_jwt_token(token: str) -> schemas.TokenData | None:
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        username: str = payload.get("sub")
-        token_data = schemas.TokenData(username=username)
-        username = token_data.username
+        token_data = schemas.TokenData(
+            username=payload.get("sub"), user_id=payload.get("uid")
+        )
     except JWTError:
         return None
-    return username
+    if token_data.username is None:
+        return None
+    return token_data
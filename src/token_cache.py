@@ -0,0 +1,73 @@
+import hashlib
+import os
+
+from . import schemas
+from .cache import database_cache_path, make_cache
+
+
+# Worker processes, which uvicorn --workers defaults to
+WEB_CONCURRENCY = int(os.environ.get("WEB_CONCURRENCY") or 1)
+TOKEN_CACHE_SIZE = int(os.environ.get("TOKEN_CACHE_SIZE") or 100_000)
+# "memory" is per process, "sqlite" is shared by all workers on the host
+TOKEN_CACHE_BACKEND = os.environ.get("TOKEN_CACHE_BACKEND") or (
+    "sqlite" if WEB_CONCURRENCY > 1 else "memory"
+)
+# Other workers' memory caches drop a changed or deleted user only when the
+# entries expire, so they are kept for a shorter time
+TOKEN_CACHE_TTL = float(
+    os.environ.get("TOKEN_CACHE_TTL")
+    or (30 if TOKEN_CACHE_BACKEND == "memory" else 300)
+)
+TOKEN_CACHE_PATH = os.environ.get("TOKEN_CACHE_PATH")
+TOKEN_CACHE_NAME = "fastapisoc-token-cache"
+
+# (user_id, token digest) -> (username,) of a user the token was checked
+# against. Shared files are per database: databases with the same SECRET_KEY
+# accept each other's tokens, which must not map to their users by id
+token_cache = make_cache(
+    TOKEN_CACHE_BACKEND,
+    TOKEN_CACHE_SIZE,
+    TOKEN_CACHE_TTL,
+    path=TOKEN_CACHE_PATH,
+    name=TOKEN_CACHE_NAME,
+)
+
+
+def shared_path() -> str:
+    """File of the sqlite backend, whichever backend this process uses"""
+    return TOKEN_CACHE_PATH or database_cache_path(TOKEN_CACHE_NAME)
+
+
+def _key(user_id: int, token: str):
+    digest = hashlib.blake2b(token.encode(), digest_size=8).digest()
+    return (user_id, int.from_bytes(digest, "big", signed=True))
+
+
+def get_user(user_id: int, token: str) -> schemas.CurrentUser | None:
+    cached = token_cache.get(_key(user_id, token))
+    if cached is None:
+        return None
+    (username,) = cached
+    return schemas.CurrentUser(id=user_id, username=username)
+
+
+def set_user(token: str, user) -> schemas.CurrentUser:
+    token_cache[_key(user.id, token)] = (user.username,)
+    return schemas.CurrentUser(id=user.id, username=user.username)
+
+
+def forget_user_tokens(func):
+    """Drop cached tokens of the user changed or deleted by the wrapped function"""
+    def wrapper(db_obj, user_obj, *args, **kwargs):
+        user_id = user_obj.id
+        token_cache.discard_first(user_id)
+        result = func(db_obj, user_obj, *args, **kwargs)
+        # Once more after the commit: until then, requests can still check
+        # tokens against the old credentials and cache them again
+        token_cache.discard_first(user_id)
+        return result
+    return wrapper
+
+
+def stats() -> dict:
+    return token_cache.stats()
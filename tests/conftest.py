@@ -0,0 +1,53 @@
+"""
+The app reads its settings from the environment when it is imported:
+make_client imports a fresh copy of src with the given settings, on a new
+migrated SQLite database.
+"""
+import importlib
+import sys
+
+import pytest
+from fastapi.testclient import TestClient
+
+# Cheap password hashing, in the test process
+FAST_HASHING = {"BCRYPT_ROUNDS": "4", "PASSWORD_HASH_WORKERS": "0"}
+
+
+def _forget_src():
+    for name in [name for name in sys.modules if name.split(".")[0] == "src"]:
+        del sys.modules[name]
+
+
+@pytest.fixture
+def make_client(tmp_path, monkeypatch):
+    clients = []
+
+    def make_client(**settings) -> TestClient:
+        settings = {
+            "DATABASE_URL": f"sqlite:///{tmp_path}/app.db",
+            **FAST_HASHING,
+            **settings,
+        }
+        for name, value in settings.items():
+            monkeypatch.setenv(name, value)
+        _forget_src()
+        migrations = importlib.import_module("src.migrations")
+        migrations.migrate(importlib.import_module("src.database").engine)
+        client = TestClient(importlib.import_module("src.main").app)
+        client.__enter__()  # Runs the startup and shutdown events
+        clients.append(client)
+        return client
+
+    yield make_client
+    for client in reversed(clients):
+        client.__exit__(None, None, None)
+    _forget_src()
+
+
+def sign_up(client: TestClient, username: str, password: str = "password") -> dict:
+    """Authorization headers of a new user"""
+    credentials = {"username": username, "password": password}
+    assert client.post("/signup/", json=credentials).status_code == 200
+    response = client.post("/account/token/", json=credentials)
+    assert response.status_code == 200, response.text
+    return {"Authorization": f"Bearer {response.json()['access_token']}"}
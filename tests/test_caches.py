@@ -0,0 +1,75 @@
+"""Shared caches hold the rows of one database only"""
+import importlib
+import os
+
+import pytest
+
+from .conftest import sign_up
+
+
+@pytest.fixture
+def shared_paths():
+    """Files of the shared caches of the test, removed afterwards"""
+    paths = []
+    yield paths
+    for path in paths:
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(path + suffix):
+                os.remove(path + suffix)
+
+
+def _reaction_cache(make_client, database_url, shared_paths):
+    make_client(DATABASE_URL=database_url, REACTION_CACHE_BACKEND="sqlite")
+    reaction_cache = importlib.import_module("src.reaction_cache")
+    shared_paths.append(reaction_cache.shared_path())
+    return reaction_cache
+
+
+def test_reaction_cache_file_depends_on_the_database(
+    make_client, tmp_path, shared_paths
+):
+    first = _reaction_cache(make_client, f"sqlite:///{tmp_path}/first.db", shared_paths)
+    first.reaction_cache[(1, 1)] = True
+    assert first.reaction_cache.path == shared_paths[0]
+
+    second = _reaction_cache(
+        make_client, f"sqlite:///{tmp_path}/second.db", shared_paths
+    )
+    assert shared_paths[1] != shared_paths[0]
+    assert second.reaction_cache.get((1, 1), "missing") == "missing"
+
+    # A new database at the same URL, e.g. after a reset
+    os.remove(tmp_path / "first.db")
+    _reaction_cache(make_client, f"sqlite:///{tmp_path}/first.db", shared_paths)
+    assert shared_paths[2] != shared_paths[0]
+
+
+def test_migrate_and_startup_empty_the_shared_cache(
+    make_client, tmp_path, shared_paths
+):
+    url = f"sqlite:///{tmp_path}/app.db"
+    reaction_cache = _reaction_cache(make_client, url, shared_paths)
+    reaction_cache.reaction_cache[(1, 1)] = True
+    importlib.import_module("src.manage").main(["migrate"])
+    assert len(reaction_cache.reaction_cache) == 0
+
+    reaction_cache.reaction_cache[(1, 1)] = True
+    # Another process starting on the same database
+    reaction_cache = _reaction_cache(make_client, url, shared_paths)
+    assert len(reaction_cache.reaction_cache) == 0
+
+
+def test_token_checked_against_another_database_is_rejected(
+    make_client, tmp_path, shared_paths
+):
+    settings = {"TOKEN_CACHE_BACKEND": "sqlite"}
+    first = make_client(DATABASE_URL=f"sqlite:///{tmp_path}/first.db", **settings)
+    shared_paths.append(importlib.import_module("src.token_cache").shared_path())
+    alice = sign_up(first, "alice")
+    # Same SECRET_KEY, and another user with alice's id
+    second = make_client(DATABASE_URL=f"sqlite:///{tmp_path}/second.db", **settings)
+    shared_paths.append(importlib.import_module("src.token_cache").shared_path())
+    sign_up(second, "mallory")
+
+    assert first.get("/account/me/", headers=alice).json()["username"] == "alice"
+    assert second.get("/account/me/", headers=alice).status_code == 401
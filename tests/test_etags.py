@@ -0,0 +1,22 @@
+"""Conditional GETs answer 304 only while the response is unchanged"""
+from .conftest import sign_up
+
+
+def test_new_post_reusing_the_id_of_a_deleted_one_is_modified(make_client):
+    client = make_client()
+    headers = sign_up(client, "alice")
+    old = client.post("/posts/new/", json={"content": "old"}, headers=headers).json()
+    etag = client.get(f"/posts/{old['id']}/").headers["ETag"]
+    feed_etag = client.get("/posts/").headers["ETag"]
+    not_modified = client.get(f"/posts/{old['id']}/", headers={"If-None-Match": etag})
+    assert not_modified.status_code == 304
+
+    assert client.delete(f"/posts/{old['id']}/", headers=headers).status_code == 200
+    new = client.post("/posts/new/", json={"content": "new"}, headers=headers).json()
+    assert new["id"] == old["id"]  # SQLite reuses the rowid of the newest row
+
+    response = client.get(f"/posts/{new['id']}/", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.json()["content"] == "new"
+    feed = client.get("/posts/", headers={"If-None-Match": feed_etag})
+    assert feed.status_code == 200
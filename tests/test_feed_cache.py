@@ -0,0 +1,65 @@
+"""Writes show in the cached anonymous feed at once, not after FEED_CACHE_TTL"""
+import importlib
+
+import pytest
+from fastapi.testclient import TestClient
+
+from .conftest import sign_up
+
+MODES = {
+    "default": {},
+    "write-behind": {"REACTION_WRITE_BEHIND": "true", "REACTION_FLUSH_INTERVAL": "60"},
+}
+
+
+def _feed(client: TestClient) -> list:
+    response = client.get("/posts/")
+    assert response.status_code == 200
+    return [
+        (post["content"], post["reactions_count"]["likes"])
+        for post in response.json()
+    ]
+
+
+def _cached_feed(make_client, **settings):
+    """A client, the headers of bob and his posts, the feed cached by another"""
+    client = make_client(FEED_CACHE_ENABLED="true", FEED_CACHE_TTL="600", **settings)
+    bob = sign_up(client, "bob")
+    post_ids = []
+    for content in ("first", "second"):
+        response = client.post("/posts/new/", json={"content": content}, headers=bob)
+        assert response.status_code == 200
+        post_ids.append(response.json()["id"])
+    anonymous = TestClient(client.app)
+    assert _feed(anonymous) == [("second", 0), ("first", 0)]
+    assert _feed(anonymous) == [("second", 0), ("first", 0)]
+    assert importlib.import_module("src.feed_cache").stats()["hits"] == 1
+    return client, bob, post_ids, anonymous
+
+
+@pytest.mark.parametrize("mode", MODES)
+def test_reaction_shows_in_the_cached_feed(make_client, mode):
+    client, _, post_ids, anonymous = _cached_feed(make_client, **MODES[mode])
+    alice = sign_up(client, "alice")
+    response = client.patch(f"/posts/{post_ids[0]}/like", headers=alice)
+    assert response.json() == {"result": "Success"}
+    assert _feed(anonymous) == [("second", 0), ("first", 1)]
+    response = client.patch(f"/posts/{post_ids[0]}/cancel", headers=alice)
+    assert response.json() == {"result": "Success"}
+    assert _feed(anonymous) == [("second", 0), ("first", 0)]
+
+
+def test_edit_shows_in_the_cached_feed(make_client):
+    client, bob, post_ids, anonymous = _cached_feed(make_client)
+    response = client.put(
+        f"/posts/{post_ids[0]}/", json={"content": "edited"}, headers=bob
+    )
+    assert response.status_code == 200
+    assert _feed(anonymous) == [("second", 0), ("edited", 0)]
+
+
+def test_delete_shows_in_the_cached_feed(make_client):
+    client, bob, post_ids, anonymous = _cached_feed(make_client)
+    response = client.delete(f"/posts/{post_ids[1]}/", headers=bob)
+    assert response.json() == {"result": "Success"}
+    assert _feed(anonymous) == [("first", 0)]
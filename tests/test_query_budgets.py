@@ -0,0 +1,112 @@
+"""
+Every route declaring a query budget keeps to it, in each database mode,
+and still does its work: responses and counters are checked along the way
+"""
+import json
+
+import pytest
+
+from .conftest import sign_up
+
+MODES = {
+    "default": {},
+    "async": {"DB_MODE": "async"},
+    # Flushed by the batch route or on shutdown only, not in between
+    "write-behind": {"REACTION_WRITE_BEHIND": "true", "REACTION_FLUSH_INTERVAL": "60"},
+}
+
+
+def _ok(response):
+    assert response.status_code == 200, response.text
+    assert "X-SQL-Queries" in response.headers
+    if response.headers["content-type"] == "application/json":
+        return response.json()
+
+
+def _counts(posts) -> dict:
+    return {
+        post["id"]: (counts["likes"], counts["dislikes"])
+        for post in posts
+        for counts in [post["reactions_count"]]
+    }
+
+
+@pytest.mark.parametrize("mode", MODES)
+def test_routes_keep_to_their_query_budget(make_client, mode):
+    client = make_client(PROFILE_SQL="true", QUERY_BUDGET_STRICT="true", **MODES[mode])
+    alice = sign_up(client, "alice")
+    bob = sign_up(client, "bob")
+    carol = sign_up(client, "carol")
+    credentials = {"username": "alice", "password": "password"}
+    token = _ok(client.post("/account/tokenform/", data=credentials))
+    assert token["token_type"] == "bearer"
+    me = _ok(client.get("/account/me/", headers=bob))
+    assert (me["username"], me["posts"]) == ("bob", [])
+
+    posts = [
+        _ok(client.post("/posts/new/", json={"content": f"bob {n}"}, headers=bob))
+        for n in range(3)
+    ]
+    assert [post["content"] for post in posts] == ["bob 0", "bob 1", "bob 2"]
+    assert _counts(posts) == {post["id"]: (0, 0) for post in posts}
+    first, second, third = post_ids = [post["id"] for post in posts]
+    edited = client.put(f"/posts/{first}/", json={"content": "edited"}, headers=bob)
+    assert _ok(edited)["content"] == "edited"
+
+    for path, headers in (
+        (f"/posts/{first}/like", alice),
+        (f"/posts/{second}/dislike", alice),
+        (f"/posts/{second}/cancel", alice),
+        # Pending reactions of another user, written by the batch's flush
+        (f"/posts/{second}/like", carol),
+        (f"/posts/{third}/dislike", carol),
+    ):
+        assert _ok(client.patch(path, headers=headers)) == {"result": "Success"}
+    operations = [
+        {"post_id": first, "action": "dislike"},
+        {"post_id": second, "action": "like"},
+        {"post_id": third, "action": "cancel"},
+    ]
+    results = _ok(client.post("/posts/reactions/batch", json=operations, headers=alice))
+    assert [result["result"] for result in results] == [
+        "Success",
+        "Success",
+        "Reaction not found",
+    ]
+    expected = {first: (0, 1), second: (2, 0), third: (0, 1)}
+
+    feed = _ok(client.get("/posts/"))
+    assert [post["id"] for post in feed] == post_ids[::-1]
+    assert _counts(feed) == expected
+    timeline = _ok(client.get(f"/posts/timeline/?author_id={me['id']}"))
+    assert _counts(timeline) == expected
+    found = _ok(client.get("/posts/search?q=bob"))
+    assert {post["id"] for post in found} == {second, third}
+    post = _ok(client.get(f"/posts/{first}/"))
+    assert (post["content"], _counts([post])) == ("edited", {first: (0, 1)})
+    users = _ok(client.get("/users/"))
+    assert [user["username"] for user in users] == ["alice", "bob", "carol"]
+    user = _ok(client.get(f"/users/{me['id']}/"))
+    assert _counts(user["posts"]) == expected
+    assert _counts(_ok(client.get(f"/users/{me['id']}/posts/"))) == expected
+    export = client.get("/export/posts/", headers=alice)
+    _ok(export)
+    exported = [json.loads(line) for line in export.text.splitlines()]
+    assert _counts(exported) == expected
+
+    assert _ok(client.delete(f"/posts/{third}/", headers=bob)) == {"result": "Success"}
+    assert [post["id"] for post in _ok(client.get("/posts/"))] == [second, first]
+    edit = {"credentials": credentials, "new_credentials": credentials}
+    assert _ok(client.put("/account/edit/", json=edit))["username"] == "alice"
+    # The deleted account has posts with reactions
+    deleted = _ok(
+        client.request(
+            "DELETE",
+            "/account/delete/",
+            json={"username": "bob", "password": "password"},
+        )
+    )
+    assert deleted == {"result": "Success"}
+    assert _ok(client.get("/posts/")) == []
+    users = _ok(client.get("/users/"))
+    assert [user["username"] for user in users] == ["alice", "carol"]
@@ -0,0 +1,53 @@
+"""Reads of the users routes are index searches, whatever the number of posts"""
+import importlib
+
+import pytest
+from sqlalchemy import event
+
+from .conftest import sign_up
+
+
+def _plans(database, statements):
+    with database.engine.connect() as connection:
+        for statement, parameters in statements:
+            if statement.lstrip().upper().startswith("SELECT"):
+                yield statement, [
+                    row[3]
+                    for row in connection.exec_driver_sql(
+                        "EXPLAIN QUERY PLAN " + statement, parameters
+                    )
+                ]
+
+
+@pytest.mark.parametrize("fast", ["false", "true"])
+@pytest.mark.parametrize(
+    "path",
+    ["/users/?limit=2", "/users/?limit=2&skip=1", "/users/1/", "/users/1/posts/"],
+)
+def test_users_routes_dont_scan_posts(make_client, fast, path):
+    client = make_client(FAST_SERIALIZATION=fast, USER_RECENT_POSTS="3")
+    for username in ("alice", "bob", "carol"):
+        headers = sign_up(client, username)
+        for number in range(5):
+            response = client.post(
+                "/posts/new/", json={"content": f"post {number}"}, headers=headers
+            )
+            assert response.status_code == 200
+
+    database = importlib.import_module("src.database")
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append((statement, parameters))
+
+    event.listen(database.engine, "before_cursor_execute", record)
+    response = client.get(path)
+    event.remove(database.engine, "before_cursor_execute", record)
+    assert response.status_code == 200
+
+    plans = list(_plans(database, statements))
+    assert plans
+    for statement, plan in plans:
+        for step in plan:
+            assert "MATERIALIZE" not in step, (statement, plan)
+            assert not step.startswith("SCAN posts"), (statement, plan)
@@ -0,0 +1,83 @@
+"""Write-behind reactions show at once and reach the database on flush"""
+import importlib
+
+import pytest
+
+from .conftest import sign_up
+
+
+@pytest.fixture
+def write_behind(make_client):
+    # Flushed by the tests only, the background task waits a minute
+    client = make_client(REACTION_WRITE_BEHIND="true", REACTION_FLUSH_INTERVAL="60")
+    alice = sign_up(client, "alice")
+    bob = sign_up(client, "bob")
+    post = client.post("/posts/new/", json={"content": "hi"}, headers=bob).json()
+    return client, alice, post["id"]
+
+
+def _counts(client, post_id) -> dict:
+    return client.get(f"/posts/{post_id}/").json()["reactions_count"]
+
+
+def _stored(post_id) -> tuple:
+    """(likes_count, dislikes_count, reactions) in the database"""
+    database = importlib.import_module("src.database")
+    models = importlib.import_module("src.models")
+    with database.SessionLocal() as db:
+        post = db.get(models.Post, post_id)
+        reactions = db.query(models.Reaction.from_id, models.Reaction.is_like).all()
+        return post.likes_count, post.dislikes_count, [tuple(row) for row in reactions]
+
+
+def _flush(client):
+    client.portal.call(importlib.import_module("src.reaction_buffer").flush)
+
+
+def test_counts_show_before_the_flush_and_persist_after(write_behind):
+    client, alice, post_id = write_behind
+    response = client.patch(f"/posts/{post_id}/like", headers=alice)
+    assert response.json() == {"result": "Success"}
+    assert _counts(client, post_id) == {"likes": 1, "dislikes": 0}
+    assert _stored(post_id) == (0, 0, [])
+
+    _flush(client)
+    assert _stored(post_id) == (1, 0, [(1, True)])
+    assert _counts(client, post_id) == {"likes": 1, "dislikes": 0}
+    response = client.patch(f"/posts/{post_id}/like", headers=alice)
+    assert response.json() == {"result": "Alredy liked"}
+
+
+def test_cancel_of_a_buffered_reaction(write_behind):
+    client, alice, post_id = write_behind
+    client.patch(f"/posts/{post_id}/dislike", headers=alice)
+    assert _counts(client, post_id) == {"likes": 0, "dislikes": 1}
+    response = client.patch(f"/posts/{post_id}/cancel", headers=alice)
+    assert response.json() == {"result": "Success"}
+    assert _counts(client, post_id) == {"likes": 0, "dislikes": 0}
+    response = client.patch(f"/posts/{post_id}/cancel", headers=alice)
+    assert response.status_code == 404
+
+    _flush(client)
+    assert _stored(post_id) == (0, 0, [])
+
+
+def test_failed_flush_keeps_the_reactions(write_behind, monkeypatch):
+    client, alice, post_id = write_behind
+    reaction_buffer = importlib.import_module("src.reaction_buffer")
+    client.patch(f"/posts/{post_id}/like", headers=alice)
+
+    def fail(changes):
+        raise RuntimeError("database unavailable")
+
+    with monkeypatch.context() as patch:
+        patch.setattr(reaction_buffer, "_write", fail)
+        with pytest.raises(RuntimeError):
+            _flush(client)
+    assert reaction_buffer.buffer.depth() == 1
+    assert _counts(client, post_id) == {"likes": 1, "dislikes": 0}
+    assert _stored(post_id) == (0, 0, [])
+
+    _flush(client)
+    assert reaction_buffer.buffer.depth() == 0
+    assert _stored(post_id) == (1, 0, [(1, True)])
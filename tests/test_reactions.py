@@ -0,0 +1,134 @@
+"""Reactions and their counters, whatever the reaction cache holds"""
+import importlib
+from types import SimpleNamespace
+
+from sqlalchemy import event
+
+from .conftest import sign_up
+
+
+def _like_on_fresh_database(make_client, database_url, cache_path):
+    client = make_client(
+        DATABASE_URL=database_url,
+        REACTION_CACHE_BACKEND="sqlite",
+        REACTION_CACHE_PATH=cache_path,
+    )
+    alice = sign_up(client, "alice")
+    bob = sign_up(client, "bob")
+    post = client.post("/posts/new/", json={"content": "hi"}, headers=bob).json()
+    response = client.patch(f"/posts/{post['id']}/like", headers=alice)
+    return response.json()["result"], client.get(f"/posts/{post['id']}/").json()
+
+
+def test_cached_reaction_of_another_database_doesnt_skip_the_write(
+    make_client, tmp_path
+):
+    # The cache file outlives the first database, e.g. after a reset
+    cache_path = str(tmp_path / "reactions.sqlite")
+    for name in ("first", "second"):
+        result, post = _like_on_fresh_database(
+            make_client, f"sqlite:///{tmp_path}/{name}.db", cache_path
+        )
+        assert result == "Success"
+        assert post["reactions_count"] == {"likes": 1, "dislikes": 0}
+
+
+def test_deletes_forget_reactions_cached_until_their_commit(make_client):
+    make_client()
+    reaction_cache = importlib.import_module("src.reaction_cache")
+    cache = reaction_cache.reaction_cache
+    database = importlib.import_module("src.database")
+
+    def delete(db, deleted):
+        # A request running meanwhile caches rows about to be deleted
+        cache[(deleted.id, 1)] = True
+        cache[(2, 1)] = True
+
+    with database.SessionLocal() as db:
+        reaction_cache.delete_post_from_cache(delete)(db, SimpleNamespace(id=1))
+        assert cache.get((2, 1)) is None
+        reaction_cache.delete_user_from_cache(delete)(db, SimpleNamespace(id=3))
+        assert cache.get((3, 1)) is None
+
+
+def test_deleting_an_account_doesnt_load_its_posts(make_client):
+    client = make_client()
+    alice = sign_up(client, "alice")
+    for number in range(3):
+        client.post("/posts/new/", json={"content": f"post {number}"}, headers=alice)
+    database = importlib.import_module("src.database")
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(database.engine, "before_cursor_execute", record)
+    response = client.request(
+        "DELETE", "/account/delete/", json={"username": "alice", "password": "password"}
+    )
+    event.remove(database.engine, "before_cursor_execute", record)
+    assert response.status_code == 200
+    assert not [statement for statement in statements if "posts.content" in statement]
+    assert client.get("/posts/").json() == []
+
+
+def _single(client, operation, headers):
+    """Result of an operation sent to the single reaction endpoints"""
+    path = f"/posts/{operation['post_id']}/{operation['action']}"
+    response = client.patch(path, headers=headers)
+    body = response.json()
+    return body["result"] if response.status_code == 200 else body["detail"]
+
+
+def test_batch_gives_the_results_of_the_single_endpoints(make_client):
+    client = make_client()
+    alice = sign_up(client, "alice")
+    bob = sign_up(client, "bob")
+    carol = sign_up(client, "carol")
+    first, second, third = [
+        client.post("/posts/new/", json={"content": "hi"}, headers=bob).json()["id"]
+        for _ in range(3)
+    ]
+    own = client.post("/posts/new/", json={"content": "mine"}, headers=alice)
+    operations = [
+        ("like", first, "Success"),
+        ("like", first, "Alredy liked"),
+        ("dislike", first, "Success"),
+        ("cancel", second, "Reaction not found"),
+        ("dislike", second, "Success"),
+        ("dislike", second, "Alredy disliked"),
+        ("cancel", second, "Success"),
+        ("like", third, "Success"),
+        ("like", 9999, "Post not found"),
+    ]
+    batch = [
+        {"post_id": post_id, "action": action} for action, post_id, _ in operations
+    ]
+    own_post = {"post_id": own.json()["id"], "action": "like"}
+
+    response = client.post(
+        "/posts/reactions/batch", json=[*batch, own_post], headers=alice
+    )
+    assert response.status_code == 200
+    results = response.json()
+    assert [result["result"] for result in results] == [
+        *(expected for _, _, expected in operations),
+        "You can't add reactions to your own posts.",
+    ]
+    assert [result["changed"] for result in results] == [
+        True, False, True, False, True, False, True, True, False, False
+    ]
+    # Another user sending the operations one by one gets the same results
+    assert [_single(client, operation, carol) for operation in batch] == [
+        result["result"] for result in results[:-1]
+    ]
+
+    counts = [
+        client.get(f"/posts/{post_id}/").json()["reactions_count"]
+        for post_id in (first, second, third)
+    ]
+    assert counts == [
+        {"likes": 0, "dislikes": 2},
+        {"likes": 0, "dislikes": 0},
+        {"likes": 2, "dislikes": 0},
+    ]
@@ -0,0 +1,27 @@
+"""Clients read their own writes while the replicas lag behind"""
+import importlib
+
+from fastapi.testclient import TestClient
+
+from .conftest import sign_up
+
+
+def test_feed_cache_serves_writers_from_the_primary(make_client, tmp_path):
+    client = make_client(
+        DATABASE_REPLICA_URLS=f"sqlite:///{tmp_path}/replica.db",
+        FEED_CACHE_ENABLED="true",
+    )
+    # The replica gets the schema, then no longer catches up
+    importlib.import_module("src.manage").main(["sync-replicas"])
+    headers = sign_up(client, "alice")
+    response = client.post("/posts/new/", json={"content": "hello"}, headers=headers)
+    assert response.status_code == 200
+    assert "read_primary" in client.cookies
+
+    # Another anonymous client caches the page as the replica has it
+    anonymous = TestClient(client.app)
+    assert anonymous.get("/posts/").json() == []
+    assert anonymous.get("/posts/").json() == []
+
+    posts = client.get("/posts/").json()
+    assert [post["content"] for post in posts] == ["hello"]
@@ -0,0 +1,33 @@
+"""Search pages reach every match, ranked or not"""
+from .conftest import sign_up
+
+
+def test_pages_go_past_the_rank_window(make_client):
+    client = make_client(SEARCH_RANK_WINDOW="5")
+    headers = sign_up(client, "alice")
+    matching = []
+    for number in range(16):
+        content = f"apple {'apple ' * (number % 3)}{number}"
+        if number % 4 == 3:
+            content = f"banana {number}"
+        post = client.post("/posts/new/", json={"content": content}, headers=headers)
+        if number % 4 != 3:
+            matching.append(post.json()["id"])
+    assert len(matching) == 12
+
+    found = []
+    cursor = None
+    while True:
+        params = {"q": "apple", "limit": 3, **({"after": cursor} if cursor else {})}
+        response = client.get("/posts/search", params=params)
+        assert response.status_code == 200, response.text
+        found += [post["id"] for post in response.json()]
+        cursor = response.headers.get("X-Next-Cursor")
+        if cursor is None:
+            break
+
+    assert sorted(found) == sorted(matching)
+    newest = sorted(matching, reverse=True)
+    # The newest matches ranked first, then the others newest first
+    assert set(found[:5]) == set(newest[:5])
+    assert found[5:] == newest[5:]